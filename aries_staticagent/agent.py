@@ -1,28 +1,75 @@
 """ Agent """
+from collections import OrderedDict
+from functools import partial
+import asyncio
 import logging
 
 from sortedcontainers import SortedSet
 
+from .instrumentation import NOOP, OTHER
+
 class NoRegisteredRouteException(Exception):
     """ Thrown when message has no registered handlers """
 
+SEQUENTIAL = 'sequential'
+CONCURRENT = 'concurrent'
+
 class Agent:
-    """ The Base of an Agent. Handles routing messages to appropriate handlers. """
-    def __init__(self):
+    """ The Base of an Agent. Handles routing messages to appropriate handlers.
+
+        Besides its one routed handler, a message type may have additional
+        handlers registered with `add_route`. With the `sequential` dispatch
+        policy they are awaited one after another; with `concurrent` they are
+        awaited together, each limited to `handler_timeout` seconds, and one
+        handler's failure does not stop the others. Handlers added with
+        `background=True` are started but not awaited.
+    """
+    DISPATCH_CACHE_SIZE = 1024
+
+    def __init__(
+            self, instrumentation=NOOP, dispatch: str = SEQUENTIAL,
+            handler_timeout: float = None):
+        if dispatch not in (SEQUENTIAL, CONCURRENT):
+            raise ValueError('Unknown dispatch policy: {}'.format(dispatch))
+        self.instrumentation = instrumentation
+        self.dispatch = dispatch
+        self.handler_timeout = handler_timeout
         self.routes = {}
+        self.additional_routes = {} # Message type to list of (handler, background)
         self.modules = {} # Protocol identifier URI to module
         self.module_versions = {} # Doc URI + Protocol to list of Module Versions
         self.logger = logging.getLogger(__name__)
 
+        # Routed message type to resolved (handlers, background handlers, label),
+        # least recently used first; cleared when routes change
+        self._dispatch = OrderedDict()
+        self._background = set()
+
     def route(self, msg_type):
         """ Register route decorator. """
         def register_route_dec(func):
             self.logger.debug('Setting route for %s to %s', msg_type, func)
             self.routes[msg_type] = func
+            self._dispatch.clear()
             return func
 
         return register_route_dec
 
+    def add_route(self, msg_type, background: bool = False):
+        """ Register an additional handler decorator.
+
+            The handler receives messages of `msg_type` alongside the routed
+            handler and any other additional handlers. Background handlers
+            are not awaited, keeping slow side effects off the critical path.
+        """
+        def add_route_dec(func):
+            self.logger.debug('Adding route for %s to %s', msg_type, func)
+            self.additional_routes.setdefault(msg_type, []).append((func, background))
+            self._dispatch.clear()
+            return func
+
+        return add_route_dec
+
     def route_module(self, module_instance):
         """ Register a module for routing.
             Modules are routed to based on protocol and version. Newer versions
@@ -38,6 +85,7 @@ class Agent:
             self.module_versions[qualified_protocol] = SortedSet()
 
         self.module_versions[qualified_protocol].add(version_info)
+        self._dispatch.clear()
 
     def get_closest_module_for_msg(self, msg):
         """ Find the closest appropriate module for a given message.
@@ -54,30 +102,137 @@ class Agent:
 
         return None
 
-    async def handle(self, msg, *args, **kwargs):
-        """ Route message """
+    def resolve_handler(self, msg):
+        """ Find the handler for a message.
+
+            Returns a callable taking the message and any extra handler
+            arguments, or None if no route matches.
+        """
+        return self._resolve_handler(msg)[0]
+
+    def _resolve_handler(self, msg):
+        """ Find (handler, route name) for a message, or (None, None). """
         if msg.type in self.routes:
-            await self.routes[msg.type](self, msg, *args, **kwargs)
-            return
+            return partial(self.routes[msg.type], self), msg.type
 
         module_instance = self.get_closest_module_for_msg(msg)
         if module_instance:
 
             if hasattr(module_instance, 'routes'):
-                await module_instance.routes[msg.type](module_instance, self, msg, *args, **kwargs)
-                return
+                if msg.type in module_instance.routes:
+                    return (
+                        partial(module_instance.routes[msg.type], module_instance, self),
+                        msg.type
+                    )
+                return None, None
 
             # If no routes defined in module, attempt to route based on method matching
             # the message type name
             if hasattr(module_instance, msg.short_type) and \
                     callable(getattr(module_instance, msg.short_type)):
 
-                await getattr(module_instance, msg.short_type)(
-                    self, #agent
-                    msg,
-                    *args,
-                    **kwargs
+                # Any minor version reaches the module, so name the route by
+                # the module's version rather than the message's
+                return (
+                    partial(getattr(module_instance, msg.short_type), self),
+                    type(module_instance).protocol_identifer_uri + '/' + msg.short_type
                 )
-                return
 
-        raise NoRegisteredRouteException
+        return None, None
+
+    def _resolve(self, msg):
+        """ Resolve (handlers, background handlers, label) for a message.
+
+            The label names the matched route, so counters keyed by it have
+            no more values than there are routes; it is OTHER if nothing
+            matched.
+        """
+        handlers = []
+        background = []
+        primary, label = self._resolve_handler(msg)
+        if primary is not None:
+            handlers.append(primary)
+        for func, is_background in self.additional_routes.get(msg.type, ()):
+            (background if is_background else handlers).append(partial(func, self))
+            label = msg.type
+        return tuple(handlers), tuple(background), label or OTHER
+
+    def type_label(self, msg):
+        """ Return the counter label for a message.
+
+            This is the name of the route the message matches, or OTHER if
+            it matches none, so senders cannot create unbounded label values.
+        """
+        resolved = self._dispatch.get(msg.type)
+        if resolved is None:
+            resolved = self._resolve(msg)
+        return resolved[2]
+
+    async def handle(self, msg, *args, **kwargs):
+        """ Route message """
+        instrumentation = self.instrumentation
+        with instrumentation.timer('route_resolution'):
+            resolved = self._dispatch.get(msg.type)
+            if resolved is not None:
+                self._dispatch.move_to_end(msg.type)
+            else:
+                resolved = self._resolve(msg)
+                # Only cache types that route, so unrouted types cannot
+                # push out the ones that do
+                if resolved[0] or resolved[1]:
+                    self._dispatch[msg.type] = resolved
+                    if len(self._dispatch) > self.DISPATCH_CACHE_SIZE:
+                        self._dispatch.popitem(last=False)
+
+        handlers, background, label = resolved
+        instrumentation.count('messages', label)
+        if not handlers and not background:
+            instrumentation.count('no_route', label)
+            raise NoRegisteredRouteException
+
+        for handler in background:
+            task = asyncio.ensure_future(self._run_isolated(handler, msg, args, kwargs))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+        try:
+            with instrumentation.timer('handler'):
+                if len(handlers) == 1 and self.handler_timeout is None:
+                    await handlers[0](msg, *args, **kwargs)
+                elif self.dispatch == CONCURRENT:
+                    await self._dispatch_concurrent(handlers, msg, args, kwargs)
+                else:
+                    for handler in handlers:
+                        await self._call(handler, msg, args, kwargs)
+        except Exception:
+            instrumentation.count('errors', 'handler')
+            raise
+
+    async def _call(self, handler, msg, args, kwargs):
+        if self.handler_timeout is None:
+            return await handler(msg, *args, **kwargs)
+        return await asyncio.wait_for(handler(msg, *args, **kwargs), self.handler_timeout)
+
+    async def _dispatch_concurrent(self, handlers, msg, args, kwargs):
+        """ Await handlers together; raise the first failure after all finish. """
+        results = await asyncio.gather(
+            *[self._call(handler, msg, args, kwargs) for handler in handlers],
+            return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        for err in errors[1:]:
+            self.logger.error('Handler for %s failed: %r', msg.type, err)
+        if errors:
+            raise errors[0]
+
+    async def _run_isolated(self, handler, msg, args, kwargs):
+        try:
+            await self._call(handler, msg, args, kwargs)
+        except Exception: # pylint: disable=broad-except
+            self.instrumentation.count('errors', 'background_handler')
+            self.logger.exception('Background handler for %s failed', msg.type)
+
+    async def join_background(self):
+        """ Wait for running background handlers to finish. """
+        while self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
@@ -0,0 +1,583 @@
+""" Static Agent Connection """
+from concurrent.futures import Executor
+import aiohttp
+import asyncio
+import atexit
+import functools
+import logging
+import weakref
+
+from .agent import Agent
+from .dedup import ReplayCache
+from .instrumentation import NOOP
+from .messages import Message
+from .outbound import OutboundQueue, is_retryable
+from .outbox import Outbox
+from .pipeline import InboundPipeline
+from .session import SessionPool
+from .websocket import WebSocketTransport, is_websocket_endpoint
+from . import crypto
+
+# Connections with a send_blocking loop still running, closed at exit
+_blocking_connections = weakref.WeakSet()
+
+@atexit.register
+def _close_blocking_connections():
+    for conn in list(_blocking_connections):
+        conn.close_blocking()
+
+class StaticAgentConnection:
+    def __init__(
+            self, endpoint, their_vk, my_vk, my_sk,
+            *,
+            session: aiohttp.ClientSession = None,
+            pool_limit: int = 100,
+            pool_limit_per_host: int = 0,
+            keepalive_timeout: float = 30.0,
+            precompute_shared_keys: bool = False,
+            executor: Executor = None,
+            inline_threshold: int = 0,
+            inbound_workers: int = 4,
+            inbound_queue_size: int = 100,
+            queue_outbound: bool = False,
+            outbound_concurrency: int = 4,
+            outbound_queue_size: int = 1000,
+            return_route: str = None,
+            instrumentation=NOOP,
+            dispatch: str = 'sequential',
+            handler_timeout: float = None,
+            replay_cache: ReplayCache = None,
+            outbox: Outbox = None,
+            keep_raw: bool = False,
+            compression: str = None,
+            compression_threshold: int = crypto.COMPRESSION_THRESHOLD):
+        """ Create a static agent connection.
+
+            Messages to ws:// and wss:// endpoints are sent over one persistent
+            WebSocket, which also delivers messages received on it to
+            `handle`. Other outbound messages are delivered over a long-lived,
+            pooled HTTP session. The session is created lazily on first send and kept alive
+            until `close()` is called. Pass `session` to share one pool between
+            several connections; a shared session is never closed by the
+            connection.
+
+            With `precompute_shared_keys`, the crypto_box shared key between
+            our key and the peer's key is computed once and reused for every
+            Authcrypt pack and unpack on this connection. At most
+            crypto.KEY_CACHE_SIZE keys are kept (see crypto.SharedKeyCache).
+
+            When `executor` (a thread or process pool) is given, packing and
+            unpacking run on it instead of the event loop. Messages smaller
+            than `inline_threshold` bytes are still processed inline, where
+            dispatching to the executor would cost more than the crypto itself.
+
+            `enqueue` hands inbound messages to a pipeline of
+            `inbound_workers` tasks with room for `inbound_queue_size` waiting
+            messages.
+
+            With `queue_outbound`, `send` and `send_many` only queue messages;
+            a background sender packs them in batches and delivers them with
+            up to `outbound_concurrency` requests in flight, retrying failures
+            with backoff (see OutboundQueue). Use `flush()` to wait for
+            delivery.
+
+            `return_route` ("all" or "thread") is added as the
+            `~transport.return_route` decorator of outbound messages, asking
+            the other end to reply over the same HTTP response or WebSocket.
+
+            `instrumentation` receives timings and counts from this connection
+            and its agent (see aries_staticagent.instrumentation).
+
+            `dispatch` and `handler_timeout` set how the agent runs several
+            handlers for one message type (see Agent and `add_route`).
+
+            With a `replay_cache` (see aries_staticagent.dedup), a message
+            whose sender and `@id` were already seen is dropped before it
+            reaches any handler, so retried deliveries are handled once. If
+            handling raises, the message is forgotten so a retry is handled.
+
+            With an `outbox` (see aries_staticagent.outbox), `send` and
+            `send_many` return once messages are packed and written to disk.
+            A background task then delivers them in batches (see
+            `drain_outbox`), retrying connection errors and 5xx responses with
+            the outbound queue's backoff. Messages still undelivered at
+            `close()` stay in the outbox for the next run. The outbox takes
+            the place of the outbound queue. All outbox I/O runs on the
+            default executor, and the outbox is compacted whenever a drain
+            empties it (see Outbox.compact).
+
+            Messages are sent and received as UTF-8 JSON bytes. With
+            `keep_raw`, handlers can read the bytes a message was received as
+            from `msg.raw`.
+
+            With `compression` (crypto.DEFLATE, or crypto.ZSTD when zstandard
+            is installed), outbound messages of at least
+            `compression_threshold` bytes are compressed before encryption
+            and marked as such in the protected header. Only enable it if the
+            other end supports the algorithm. Compressed inbound messages are
+            always decompressed.
+        """
+        self.endpoint = endpoint
+        self.their_vk = crypto.b58_to_bytes(their_vk)
+        self.my_vk = crypto.b58_to_bytes(my_vk)
+        self.my_sk = crypto.b58_to_bytes(my_sk)
+
+        self.instrumentation = instrumentation
+        self._agent = Agent(instrumentation, dispatch, handler_timeout)
+        self._shared_keys = crypto.SharedKeyCache() if precompute_shared_keys else None
+        self.executor = executor
+        self.inline_threshold = inline_threshold
+        self.inbound = InboundPipeline(
+            self.handle, workers=inbound_workers, maxsize=inbound_queue_size
+        )
+        self.queue_outbound = queue_outbound
+        self.outbound = OutboundQueue(
+            self._pack_many,
+            self._deliver,
+            concurrency=outbound_concurrency,
+            maxsize=outbound_queue_size,
+            on_response=self._handle_response
+        )
+
+        self.replay_cache = replay_cache
+        self.outbox = outbox
+        self.keep_raw = keep_raw
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self._draining = None
+        self._drain_task = None
+        self._drain_wake = None
+        self._drain_requested = False
+        self._closing = False
+        self.logger = logging.getLogger(__name__)
+        self.return_route = return_route
+        self._pending_replies = {} # Thread ID to future awaiting reply
+
+        self._sync = None
+        self._manager = None
+        self._websocket = WebSocketTransport(
+            endpoint, lambda: self.session, self.handle
+        ) if is_websocket_endpoint(endpoint) else None
+        self._pool = SessionPool(session, pool_limit, pool_limit_per_host, keepalive_timeout)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """ Return the pooled HTTP session, creating it if necessary. """
+        if self._manager is not None:
+            return self._manager.session
+        return self._pool.session
+
+    async def close(self):
+        """ Stop the inbound pipeline, deliver queued and outbox messages and
+            close the pooled HTTP session, if owned by this connection.
+        """
+        await self.inbound.stop()
+        await self.outbound.stop()
+        if self.outbox is not None:
+            await self._close_outbox()
+        if self._websocket is not None:
+            await self._websocket.close()
+        await self._pool.close()
+
+    async def _close_outbox(self):
+        """ Make a last attempt to drain the outbox, then compact it. """
+        self._closing = True
+        task, self._drain_task = self._drain_task, None
+        try:
+            if task is not None and not task.done():
+                # The background task makes one more attempt and stops
+                self._drain_wake.set()
+                await task
+            else:
+                await self._drain()
+        except Exception: # pylint: disable=broad-except
+            self.logger.exception('Failed to drain outbox')
+        finally:
+            self._closing = False
+        await asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(self.outbox.compact, force=True)
+        )
+
+    def route(self, msg_type):
+        """ Wrap Agent.route """
+        return self._agent.route(msg_type)
+
+    def add_route(self, msg_type, background: bool = False):
+        """ Wrap Agent.add_route """
+        return self._agent.add_route(msg_type, background)
+
+    async def _run_crypto(self, size, func, *args):
+        """ Run a crypto operation inline or on the executor. """
+        if self.executor is None or size < self.inline_threshold:
+            return func(*args)
+
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, functools.partial(func, *args)
+        )
+
+    async def _pack(self, serialized):
+        """ Pack a serialized message for the other end of this connection. """
+        with self.instrumentation.timer('pack'):
+            return await self._run_crypto(
+                len(serialized),
+                functools.partial(
+                    crypto.pack_message,
+                    compression=self.compression,
+                    compression_threshold=self.compression_threshold
+                ),
+                serialized,
+                [self.their_vk],
+                self.my_vk,
+                self.my_sk,
+                self._shared_keys
+            )
+
+    def _serialize(self, msg):
+        with self.instrumentation.timer('serialize'):
+            return msg.serialize(as_bytes=True)
+
+    async def handle(self, packed_message):
+        """ Unpack and handle message. """
+        try:
+            with self.instrumentation.timer('unpack'):
+                (msg, sender_vk, recip_vk) = await self._run_crypto(
+                    len(packed_message),
+                    functools.partial(crypto.unpack_message, as_bytes=True),
+                    packed_message,
+                    self.my_vk,
+                    self.my_sk,
+                    self._shared_keys
+                )
+        except Exception:
+            self.instrumentation.count('errors', 'unpack')
+            raise
+        await self._handle_unpacked(msg, sender_vk, recip_vk)
+
+    async def handle_stream(self, stream, chunk_size: int = 65536):
+        """ Unpack and handle a message read from a stream.
+
+            `stream` is anything with a coroutine `read(n)`, such as an
+            aiohttp request's `content`. The envelope is parsed and decoded
+            as it arrives, keeping memory near one copy of the message for
+            large payloads (see crypto.EnvelopeReader).
+        """
+        try:
+            with self.instrumentation.timer('unpack'):
+                envelope = crypto.EnvelopeReader()
+                while True:
+                    chunk = await stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    envelope.feed(chunk)
+                envelope.close()
+                (msg, sender_vk, recip_vk) = await self._run_crypto(
+                    len(envelope),
+                    crypto.unpack_envelope,
+                    envelope,
+                    self.my_vk,
+                    self.my_sk,
+                    self._shared_keys
+                )
+        except Exception:
+            self.instrumentation.count('errors', 'unpack')
+            raise
+        await self._handle_unpacked(msg, sender_vk, recip_vk)
+
+    def enqueue(self, packed_message):
+        """ Queue a packed message for handling by the inbound pipeline.
+
+            Raises PipelineFullException when the queue is full.
+        """
+        self.inbound.submit(packed_message)
+
+    async def _handle_unpacked(self, msg, sender_vk, recip_vk):
+        """ Deserialize and handle an unpacked message.
+
+            Replies awaited by `send_and_await` are returned to the waiting
+            caller instead of being routed. Messages already seen by the
+            replay cache are dropped; a message whose handling raises is
+            removed from the cache again.
+        """
+        try:
+            with self.instrumentation.timer('deserialize'):
+                msg = Message.deserialize(msg, self.keep_raw)
+        except Exception:
+            self.instrumentation.count('errors', 'deserialize')
+            raise
+        replay_id = None
+        if self.replay_cache is not None and '@id' in msg:
+            if self.replay_cache.seen(sender_vk, msg['@id']):
+                self.instrumentation.count('duplicates', self._agent.type_label(msg))
+                return
+            replay_id = msg['@id']
+        try:
+            if self._pending_replies:
+                thread = msg.get('~thread')
+                thid = thread.get('thid') if isinstance(thread, dict) else None
+                reply = self._pending_replies.get(thid)
+                if reply is not None and not reply.done():
+                    reply.set_result(msg)
+                    return
+
+            await self._agent.handle(msg)
+        except BaseException:
+            if replay_id is not None:
+                self.replay_cache.forget(sender_vk, replay_id)
+            raise
+
+    def _prepare(self, msg, return_route=None):
+        """ Convert msg to a Message and apply the return route decorator. """
+        if isinstance(msg, dict):
+            msg = Message(msg)
+
+        return_route = return_route or self.return_route
+        if return_route and '~transport' not in msg:
+            msg['~transport'] = {'return_route': return_route}
+        return msg
+
+    async def send(self, msg):
+        msg = self._prepare(msg)
+
+        if self.outbox is not None:
+            await self._put_outbox([await self._pack(self._serialize(msg))])
+            return
+
+        if self.queue_outbound:
+            self.outbound.submit(self._serialize(msg))
+            return
+
+        packed_msg = await self._pack(self._serialize(msg))
+        await self._handle_response(await self._deliver(packed_msg))
+
+    async def send_many(self, msgs):
+        """ Pack and send many messages.
+
+            Messages are packed as a batch, on the connection's executor if
+            configured, then posted concurrently over the pooled session.
+        """
+        serialized = [self._serialize(self._prepare(msg)) for msg in msgs]
+
+        if self.outbox is not None:
+            await self._put_outbox(await self._pack_many(serialized))
+            return
+
+        if self.queue_outbound:
+            for msg in serialized:
+                self.outbound.submit(msg)
+            return
+
+        packed_msgs = await self._pack_many(serialized)
+        responses = await asyncio.gather(
+            *[self._deliver(packed_msg) for packed_msg in packed_msgs]
+        )
+        for response in responses:
+            await self._handle_response(response)
+
+    async def send_and_await(self, msg, timeout: float = 30.0):
+        """ Send a message and wait for the reply in its thread.
+
+            The message is sent directly, bypassing the outbound queue, and
+            asks for replies in its thread to be returned over the same
+            transport (`~transport.return_route`, "thread" unless the
+            connection or message sets it). The
+            first message received with a `~thread.thid` matching the sent
+            message's `@id` is returned.
+
+            Raises asyncio.TimeoutError if no reply arrives within `timeout`.
+        """
+        msg = self._prepare(msg, return_route=self.return_route or 'thread')
+        reply = asyncio.get_event_loop().create_future()
+        self._pending_replies[msg.id] = reply
+        try:
+            packed_msg = await self._pack(self._serialize(msg))
+            await self._handle_response(await self._deliver(packed_msg))
+            return await asyncio.wait_for(reply, timeout)
+        finally:
+            del self._pending_replies[msg.id]
+
+    async def flush(self):
+        """ Wait for queued outbound messages to be delivered. """
+        await self.outbound.flush()
+
+    async def _put_outbox(self, packed_msgs):
+        """ Write packed messages to the outbox off the event loop and start
+            draining it.
+        """
+        await asyncio.get_event_loop().run_in_executor(
+            None, self.outbox.put, self.endpoint, packed_msgs
+        )
+        self._request_drain()
+
+    async def drain_outbox(self) -> int:
+        """ Deliver messages waiting in the outbox, returning how many were
+            delivered.
+
+            Messages are delivered in batches, oldest first. Draining stops at
+            the first batch with a connection error or 5xx response, leaving
+            the failed messages for a later drain. Messages refused outright
+            (e.g. a 4xx response) are logged and removed.
+        """
+        delivered, _ = await self._drain()
+        return delivered
+
+    async def _drain(self):
+        """ Drain the outbox, returning (delivered, whether it was emptied). """
+        if self.outbox is None:
+            return 0, True
+        if self._draining is None:
+            self._draining = asyncio.Lock()
+
+        loop = asyncio.get_event_loop()
+        delivered = 0
+        async with self._draining:
+            while True:
+                batch = await loop.run_in_executor(None, self.outbox.pending, self.endpoint)
+                if not batch:
+                    if delivered:
+                        await loop.run_in_executor(None, self.outbox.compact)
+                    return delivered, True
+
+                results = await asyncio.gather(
+                    *[self._deliver(packed_msg) for _, packed_msg in batch],
+                    return_exceptions=True
+                )
+                done = []
+                responses = []
+                retry = False
+                for (entry_id, _), result in zip(batch, results):
+                    if not isinstance(result, Exception):
+                        done.append(entry_id)
+                        responses.append(result)
+                        delivered += 1
+                    elif is_retryable(result):
+                        retry = True
+                    else:
+                        self.logger.error('Dropping undeliverable outbox message: %s', result)
+                        done.append(entry_id)
+                await loop.run_in_executor(None, self.outbox.remove, done)
+
+                # Entries are removed first, so a failing handler can't cause a resend
+                for response in responses:
+                    try:
+                        await self._handle_response(response)
+                    except Exception: # pylint: disable=broad-except
+                        self.logger.exception('Failed to handle response to outbox message')
+
+                if retry:
+                    self.logger.debug('Outbox delivery to %s failed; will retry', self.endpoint)
+                    return delivered, False
+
+    def _request_drain(self):
+        """ Make sure a background task is draining the outbox. """
+        self._drain_requested = True
+        if self._drain_task is None or self._drain_task.done():
+            if self._drain_wake is None:
+                self._drain_wake = asyncio.Event()
+            self._drain_wake.clear()
+            self._drain_task = asyncio.ensure_future(self._drain_in_background())
+
+    async def _drain_in_background(self):
+        """ Drain the outbox until it is empty, backing off after failures. """
+        delay = self.outbound.backoff
+        while self._drain_requested:
+            self._drain_requested = False
+            try:
+                _, emptied = await self._drain()
+            except Exception: # pylint: disable=broad-except
+                self.logger.exception('Failed to drain outbox')
+                emptied = False
+            if emptied:
+                delay = self.outbound.backoff
+                continue
+            if self._closing:
+                return
+
+            self._drain_requested = True
+            try:
+                await asyncio.wait_for(self._drain_wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(self.outbound.max_backoff, delay * 2)
+
+    async def _pack_many(self, serialized):
+        """ Pack a batch of serialized messages, preserving order. """
+        if self.executor is None:
+            with self.instrumentation.timer('pack_batch'):
+                return crypto.pack_messages(
+                    serialized, [self.their_vk], self.my_vk, self.my_sk, self._shared_keys,
+                    compression=self.compression,
+                    compression_threshold=self.compression_threshold
+                )
+
+        if self._shared_keys is not None:
+            crypto.shared_key(self._shared_keys, self.my_vk, self.my_sk, self.their_vk)
+        return await asyncio.gather(*[self._pack(msg) for msg in serialized])
+
+    async def _deliver(self, packed_msg):
+        """ Deliver a packed message over the endpoint's transport.
+
+            Returns the response body to handle, if any. Any exception raised
+            means the message was not delivered.
+        """
+        try:
+            with self.instrumentation.timer('send'):
+                if self._websocket is not None:
+                    await self._websocket.send(packed_msg)
+                    return None
+                return await self._post(packed_msg)
+        except Exception:
+            self.instrumentation.count('errors', 'send')
+            raise
+
+    async def _post(self, packed_msg):
+        """ Post a packed message to the endpoint.
+
+            Returns the response body, or None for a plain acceptance. The
+            message counts as delivered once the status is checked; a body
+            that cannot be read is logged and dropped. Raises
+            aiohttp.ClientResponseError on error status.
+        """
+        headers = {'content-type': 'application/ssi-agent-wire'}
+        async with self.session.post(self.endpoint, data=packed_msg, headers=headers) as resp:
+            resp.raise_for_status()
+            if resp.status == 202:
+                return None
+            try:
+                return await resp.read() or None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                self.logger.warning('Failed to read response from %s: %s', self.endpoint, err)
+                return None
+
+    async def _handle_response(self, body):
+        """ Handle a response body returned by a delivery as an inbound message. """
+        if body is not None:
+            await self.handle(body)
+
+    def send_blocking(self, msg):
+        """ Send a message from synchronous code.
+
+            The send runs on a background event loop kept for this connection
+            (see SyncStaticAgentConnection), so repeated calls reuse the pooled
+            session. The loop is shut down by `close_blocking()` or at exit.
+        """
+        self._blocking().send(msg).result()
+
+    def close_blocking(self):
+        """ Close the connection and stop the loop used by send_blocking. """
+        _blocking_connections.discard(self)
+        if self._sync is not None:
+            self._sync.close()
+            self._sync = None
+
+    def _blocking(self):
+        if self._sync is None:
+            from .sync import SyncStaticAgentConnection
+            self._sync = SyncStaticAgentConnection(connection=self)
+            _blocking_connections.add(self)
+        return self._sync
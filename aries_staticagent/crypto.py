@@ -6,18 +6,45 @@
 """
 
 from collections import OrderedDict
-from typing import Callable, Optional, Sequence
+from concurrent.futures import Executor
+from functools import lru_cache, partial
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, Mapping, MutableMapping, Optional, Sequence,
+    Tuple, Union
+)
 import base64
+import ctypes
 import json
+import re
+import zlib
 
 import base58
 import msgpack
 import pysodium
 
+try:
+    import zstandard
+except ImportError: # pragma: no cover
+    zstandard = None
+
+from .utils import json_loads
+
 class CryptoError(Exception):
     """ CryptoError raised on failed crypto call. """
 
 
+KEY_CACHE_SIZE = 1024
+
+# Payload compression, signalled by "zip" in the protected header
+DEFLATE = "DEF"
+ZSTD = "zstd"
+COMPRESSION_THRESHOLD = 1024
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+# A zstd block of up to 128 KiB can take 4 input bytes, so each slice of
+# this many bytes yields at most 4 MiB
+_ZSTD_INPUT_SLICE = 128
+
+
 def b64_to_bytes(val: str, urlsafe=False) -> bytes:
     """Convert a base 64 string to bytes."""
     if urlsafe:
@@ -41,6 +68,109 @@ def bytes_to_b58(val: bytes) -> str:
     """Convert a byte string to base 58."""
     return base58.b58encode(val).decode("ascii")
 
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def verkey_to_b58(verkey: bytes) -> str:
+    """Convert a verkey to base 58, caching the result."""
+    return bytes_to_b58(verkey)
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def b58_to_verkey(verkey: (str, bytes)) -> bytes:
+    """Convert a base 58 verkey to bytes, caching the result."""
+    return base58.b58decode(verkey)
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def verkey_to_box_pk(verkey: bytes) -> bytes:
+    """Convert an ed25519 verkey to a curve25519 public key, caching the result."""
+    return pysodium.crypto_sign_pk_to_box_pk(verkey)
+
+
+
+
+class SharedKeyCache(OrderedDict):
+    """
+    Mapping of precomputed shared keys holding at most `maxsize` entries.
+
+    Unpacking computes a shared key for whatever sender verkey a message
+    names, so an unbounded mapping would grow with every key a peer makes
+    up; the least recently used keys are evicted instead.
+    """
+
+    def __init__(self, maxsize: int = KEY_CACHE_SIZE):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get(self, key, default=None):
+        try:
+            self.move_to_end(key)
+        except KeyError:
+            return default
+        return super().get(key, default)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            try:
+                self.popitem(last=False)
+            except KeyError:
+                break
+
+
+# Converted secret keys, keyed by the verkey half of the ed25519 sigkey so
+# that secret keys are never held as cache keys
+_box_sks = SharedKeyCache()
+
+
+def sigkey_to_box_sk(sigkey: bytes) -> bytes:
+    """Convert an ed25519 sigkey to a curve25519 secret key, caching the result."""
+    verkey = bytes(sigkey[32:])
+    box_sk = _box_sks.get(verkey)
+    if box_sk is None:
+        box_sk = pysodium.crypto_sign_sk_to_box_sk(sigkey)
+        _box_sks[verkey] = box_sk
+    return box_sk
+
+
+def clear_key_cache():
+    """Clear cached key conversions."""
+    verkey_to_b58.cache_clear()
+    b58_to_verkey.cache_clear()
+    verkey_to_box_pk.cache_clear()
+    _box_sks.clear()
+
+
+def shared_key(
+        shared_keys: MutableMapping, my_verkey: bytes, my_sigkey: bytes, their_verkey: bytes
+) -> bytes:
+    """
+    Retrieve the precomputed crypto_box shared key for a pair of keys.
+
+    The shared key is computed with crypto_box_beforenm on first use and stored
+    in `shared_keys`, keyed by (my_verkey, their_verkey).
+
+    Args:
+        shared_keys: Mapping used to store computed shared keys
+        my_verkey: Our verkey
+        my_sigkey: Our sigkey
+        their_verkey: The other party's verkey
+
+    Returns:
+        The shared key
+
+    """
+    cache_key = (my_verkey, their_verkey)
+    key = shared_keys.get(cache_key)
+    if key is None:
+        key = pysodium.crypto_box_beforenm(
+            verkey_to_box_pk(their_verkey), sigkey_to_box_sk(my_sigkey)
+        )
+        shared_keys[cache_key] = key
+    return key
+
+
 def create_keypair(seed: bytes = None) -> (bytes, bytes):
     """
     Create a public and private signing keypair from a seed value.
@@ -159,7 +289,7 @@ def anon_crypt_message(message: bytes, to_verkey: bytes) -> bytes:
         The anon encrypted message
 
     """
-    pk = pysodium.crypto_sign_pk_to_box_pk(to_verkey)
+    pk = verkey_to_box_pk(to_verkey)
     enc_message = pysodium.crypto_box_seal(message, pk)
     return enc_message
 
@@ -201,13 +331,13 @@ def auth_crypt_message(
 
     """
     nonce = pysodium.randombytes(pysodium.crypto_box_NONCEBYTES)
-    target_pk = pysodium.crypto_sign_pk_to_box_pk(to_verkey)
-    sk = pysodium.crypto_sign_sk_to_box_sk(from_sigkey)
+    target_pk = verkey_to_box_pk(to_verkey)
+    sk = sigkey_to_box_sk(from_sigkey)
     enc_body = pysodium.crypto_box(message, nonce, target_pk, sk)
     combo_box = OrderedDict(
         [
             ("msg", bytes_to_b64(enc_body)),
-            ("sender", bytes_to_b58(from_verkey)),
+            ("sender", verkey_to_b58(from_verkey)),
             ("nonce", bytes_to_b64(nonce)),
         ]
     )
@@ -228,21 +358,62 @@ def auth_decrypt_message(enc_message: bytes, my_verkey: bytes, my_sigkey: bytes)
         A tuple of (decrypted message, sender verkey)
 
     """
-    pk = pysodium.crypto_sign_pk_to_box_pk(my_verkey)
-    sk = pysodium.crypto_sign_sk_to_box_sk(my_sigkey)
+    pk = verkey_to_box_pk(my_verkey)
+    sk = sigkey_to_box_sk(my_sigkey)
     body = pysodium.crypto_box_seal_open(enc_message, pk, sk)
 
     unpacked = msgpack.unpackb(body, raw=False)
     sender_vk = unpacked["sender"]
     nonce = b64_to_bytes(unpacked["nonce"])
     enc_message = b64_to_bytes(unpacked["msg"])
-    sender_pk = pysodium.crypto_sign_pk_to_box_pk(b58_to_bytes(sender_vk))
+    sender_pk = verkey_to_box_pk(b58_to_verkey(sender_vk))
     message = pysodium.crypto_box_open(enc_message, nonce, sender_pk, sk)
     return message, sender_vk
 
 
+def _prepare_pack_recipient(
+        cek: bytes, from_verkey: Optional[bytes], from_sigkey: Optional[bytes],
+        sender_vk: Optional[bytes], sender_sk: Optional[bytes],
+        shared_keys: Optional[MutableMapping], target_vk: bytes
+) -> OrderedDict:
+    """
+    Assemble the recipients block entry for a single recipient.
+
+    `sender_vk` (base 58, ascii encoded) and `sender_sk` (curve25519) are
+    derived once by the caller rather than for every recipient.
+    """
+    target_pk = verkey_to_box_pk(target_vk)
+    if sender_vk:
+        enc_sender = pysodium.crypto_box_seal(sender_vk, target_pk)
+        nonce = pysodium.randombytes(pysodium.crypto_box_NONCEBYTES)
+        if shared_keys is not None:
+            enc_cek = pysodium.crypto_box_afternm(
+                cek, nonce, shared_key(shared_keys, from_verkey, from_sigkey, target_vk)
+            )
+        else:
+            enc_cek = pysodium.crypto_box(cek, nonce, target_pk, sender_sk)
+        header = OrderedDict((
+            ("kid", verkey_to_b58(target_vk)),
+            ("sender", bytes_to_b64(enc_sender, urlsafe=True)),
+            ("iv", bytes_to_b64(nonce, urlsafe=True)),
+        ))
+    else:
+        enc_cek = pysodium.crypto_box_seal(cek, target_pk)
+        header = OrderedDict((
+            ("kid", verkey_to_b58(target_vk)),
+            ("sender", None),
+            ("iv", None),
+        ))
+
+    return OrderedDict((
+        ("encrypted_key", bytes_to_b64(enc_cek, urlsafe=True)),
+        ("header", header),
+    ))
+
+
 def prepare_pack_recipient_keys(
-        to_verkeys: Sequence[bytes], from_verkey: bytes = None, from_sigkey: bytes = None
+        to_verkeys: Sequence[bytes], from_verkey: bytes = None, from_sigkey: bytes = None,
+        shared_keys: MutableMapping = None, executor: Executor = None, zip_alg: str = None
 ) -> (str, bytes):
     """
     Assemble the recipients block of a packed message.
@@ -251,6 +422,11 @@ def prepare_pack_recipient_keys(
         to_verkeys: Verkeys of recipients
         from_verkey: Sender Verkey needed to authcrypt package
         from_sigkey: Sender Sigkey needed to authcrypt package
+        shared_keys: Optional mapping of precomputed shared keys; when given,
+            authcrypt uses crypto_box_beforenm/afternm (see `shared_key`)
+        executor: Optional thread pool used to box the key for each
+            recipient in parallel; worthwhile for large recipient lists
+        zip_alg: Compression applied to the payload, if any
 
     Returns:
         A tuple of (json result, key)
@@ -261,49 +437,21 @@ def prepare_pack_recipient_keys(
         raise CryptoError('Both verkey and sigkey needed to authenticated encrypt message')
 
     cek = pysodium.crypto_secretstream_xchacha20poly1305_keygen()
-    recips = []
 
-    for target_vk in to_verkeys:
-        target_pk = pysodium.crypto_sign_pk_to_box_pk(target_vk)
-        if from_verkey:
-            sender_vk = bytes_to_b58(from_verkey).encode("ascii")
-            enc_sender = pysodium.crypto_box_seal(sender_vk, target_pk)
-            sk = pysodium.crypto_sign_sk_to_box_sk(from_sigkey)
+    if from_verkey:
+        sender_vk = verkey_to_b58(from_verkey).encode("ascii")
+        sender_sk = sigkey_to_box_sk(from_sigkey) if shared_keys is None else None
+    else:
+        sender_vk = None
+        sender_sk = None
 
-            nonce = pysodium.randombytes(pysodium.crypto_box_NONCEBYTES)
-            enc_cek = pysodium.crypto_box(cek, nonce, target_pk, sk)
-        else:
-            enc_sender = None
-            nonce = None
-            enc_cek = pysodium.crypto_box_seal(cek, target_pk)
-
-        recips.append(
-            OrderedDict(
-                [
-                    ("encrypted_key", bytes_to_b64(enc_cek, urlsafe=True)),
-                    (
-                        "header",
-                        OrderedDict(
-                            [
-                                ("kid", bytes_to_b58(target_vk)),
-                                (
-                                    "sender",
-                                    bytes_to_b64(enc_sender, urlsafe=True)
-                                    if enc_sender
-                                    else None,
-                                ),
-                                (
-                                    "iv",
-                                    bytes_to_b64(nonce, urlsafe=True)
-                                    if nonce
-                                    else None,
-                                ),
-                            ]
-                        ),
-                    ),
-                ]
-            )
-        )
+    prepare_recip = partial(
+        _prepare_pack_recipient, cek, from_verkey, from_sigkey, sender_vk, sender_sk, shared_keys
+    )
+    if executor is None:
+        recips = [prepare_recip(target_vk) for target_vk in to_verkeys]
+    else:
+        recips = list(executor.map(prepare_recip, to_verkeys))
 
     data = OrderedDict(
         [
@@ -313,11 +461,118 @@ def prepare_pack_recipient_keys(
             ("recipients", recips),
         ]
     )
+    if zip_alg is not None:
+        data["zip"] = zip_alg
     return json.dumps(data), cek
 
 
+def compression_algorithms() -> Tuple[str, ...]:
+    """Return the payload compression algorithms available here."""
+    if zstandard is not None:
+        return (DEFLATE, ZSTD)
+    return (DEFLATE,)
+
+
+def compress_payload(message_bin: bytes, algorithm: str) -> bytes:
+    """
+    Compress a payload before encryption.
+
+    Args:
+        message_bin: The payload
+        algorithm: DEFLATE (raw deflate, as in JWE) or ZSTD
+
+    Returns:
+        The compressed payload
+
+    """
+    if algorithm == DEFLATE:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(message_bin) + compressor.flush()
+    if algorithm == ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor().compress(message_bin)
+    raise CryptoError("Unsupported compression algorithm: {}".format(algorithm))
+
+
+def decompress_payload(
+        data: bytes, algorithm: str, max_size: int = MAX_DECOMPRESSED_SIZE
+) -> bytes:
+    """
+    Decompress a decrypted payload.
+
+    Args:
+        data: The compressed payload
+        algorithm: The "zip" value of the protected header
+        max_size: Largest decompressed size accepted
+
+    Returns:
+        The payload
+
+    Raises:
+        ValueError: If the algorithm is unsupported, the data is invalid
+            or it decompresses to more than `max_size` bytes
+
+    """
+    if algorithm == DEFLATE:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        try:
+            output = decompressor.decompress(data, max_size)
+        except zlib.error as err:
+            raise ValueError("Invalid compressed payload") from err
+        if decompressor.unconsumed_tail:
+            raise ValueError("Compressed payload too large")
+        if not decompressor.eof:
+            raise ValueError("Invalid compressed payload")
+        return output
+    if algorithm == ZSTD and zstandard is not None:
+        output = bytearray()
+        try:
+            if zstandard.frame_content_size(data) > max_size:
+                raise ValueError("Compressed payload too large")
+            # The frame need not declare its size, so feed it in small slices
+            # to bound how far output can run past max_size before it is
+            # refused
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+            for start in range(0, len(data), _ZSTD_INPUT_SLICE):
+                output += decompressor.decompress(data[start:start + _ZSTD_INPUT_SLICE])
+                if len(output) > max_size:
+                    raise ValueError("Compressed payload too large")
+        except zstandard.ZstdError as err:
+            raise ValueError("Invalid compressed payload") from err
+        if not decompressor.eof:
+            raise ValueError("Invalid compressed payload")
+        return bytes(output)
+    raise ValueError("Unsupported compression algorithm: {}".format(algorithm))
+
+
+def _maybe_compress(
+        message_bin: bytes, compression: Optional[str], threshold: int
+) -> (bytes, Optional[str]):
+    """Compress a payload if asked to and worthwhile, returning (payload, zip)."""
+    if compression is None or len(message_bin) < threshold:
+        return message_bin, None
+    compressed = compress_payload(message_bin, compression)
+    if len(compressed) >= len(message_bin):
+        return message_bin, None
+    return compressed, compression
+
+
+def create_keyring(keypairs: Iterable[Tuple[bytes, bytes]]) -> Dict[str, Tuple[bytes, bytes]]:
+    """
+    Create a keyring from (verkey, sigkey) pairs.
+
+    Args:
+        keypairs: The keypairs to include
+
+    Returns:
+        A mapping of base 58 verkey (kid) to (verkey, sigkey)
+
+    """
+    return {verkey_to_b58(verkey): (verkey, sigkey) for verkey, sigkey in keypairs}
+
+
 def locate_pack_recipient_key(
-        recipients: Sequence[dict], my_verkey: bytes, my_sigkey: bytes
+        recipients: Sequence[dict], my_verkey: bytes = None, my_sigkey: bytes = None,
+        shared_keys: MutableMapping = None, keyring: Mapping[str, Tuple[bytes, bytes]] = None
 ) -> (bytes, str, str):
     """
     Locate pack recipient key.
@@ -327,7 +582,11 @@ def locate_pack_recipient_key(
 
     Args:
         recipients: Recipients to locate
-        find_key: Function used to find private key
+        my_verkey: Our verkey
+        my_sigkey: Our sigkey
+        shared_keys: Optional mapping of precomputed shared keys
+        keyring: Mapping of kid to (verkey, sigkey) to use instead of a
+            single verkey and sigkey (see `create_keyring`)
 
     Returns:
         A tuple of (cek, sender_vk, recip_vk_b58)
@@ -336,64 +595,96 @@ def locate_pack_recipient_key(
         ValueError: If no corresponding recipient key found
 
     """
-    not_found = []
+    if keyring is None:
+        keyring = {verkey_to_b58(my_verkey): (my_verkey, my_sigkey)}
+
+    index = {}
     for recip in recipients:
         if not recip or "header" not in recip or "encrypted_key" not in recip:
             raise ValueError("Invalid recipient header")
+        index[recip["header"].get("kid")] = recip
+
+    if len(keyring) < len(index):
+        kids = (kid for kid in keyring if kid in index)
+    else:
+        kids = (kid for kid in index if kid in keyring)
+    recip_vk_b58 = next(kids, None)
+    if recip_vk_b58 is None:
+        raise ValueError("No corresponding recipient key found in {}".format(list(index)))
+
+    recip = index[recip_vk_b58]
+    my_verkey, my_sigkey = keyring[recip_vk_b58]
+    pk = verkey_to_box_pk(my_verkey)
+    sk = sigkey_to_box_sk(my_sigkey)
+
+    encrypted_key = b64_to_bytes(recip["encrypted_key"], urlsafe=True)
+
+    nonce_b64 = recip["header"].get("iv")
+    nonce = b64_to_bytes(nonce_b64, urlsafe=True) if nonce_b64 else None
+    sender_b64 = recip["header"].get("sender")
+    enc_sender = b64_to_bytes(sender_b64, urlsafe=True) if sender_b64 else None
+
+    if nonce and enc_sender:
+        sender_vk_bin = pysodium.crypto_box_seal_open(enc_sender, pk, sk)
+        sender_vk = sender_vk_bin.decode("ascii")
+        if shared_keys is not None:
+            cek = pysodium.crypto_box_open_afternm(
+                encrypted_key,
+                nonce,
+                shared_key(shared_keys, my_verkey, my_sigkey, b58_to_verkey(sender_vk_bin))
+            )
+        else:
+            sender_pk = verkey_to_box_pk(b58_to_verkey(sender_vk_bin))
+            cek = pysodium.crypto_box_open(encrypted_key, nonce, sender_pk, sk)
+    else:
+        sender_vk = None
+        cek = pysodium.crypto_box_seal_open(encrypted_key, pk, sk)
+    return cek, sender_vk, recip_vk_b58
 
-        recip_vk_b58 = recip["header"].get("kid")
-
-        if bytes_to_b58(my_verkey) != recip_vk_b58:
-            not_found.append(recip_vk_b58)
-            continue
-
-        recip_vk = b58_to_bytes(recip_vk_b58)
-        pk = pysodium.crypto_sign_pk_to_box_pk(my_verkey)
-        sk = pysodium.crypto_sign_sk_to_box_sk(my_sigkey)
-
-        encrypted_key = b64_to_bytes(recip["encrypted_key"], urlsafe=True)
-
-        nonce_b64 = recip["header"].get("iv")
-        nonce = b64_to_bytes(nonce_b64, urlsafe=True) if nonce_b64 else None
-        sender_b64 = recip["header"].get("sender")
-        enc_sender = b64_to_bytes(sender_b64, urlsafe=True) if sender_b64 else None
 
-        if nonce and enc_sender:
-            sender_vk_bin = pysodium.crypto_box_seal_open(enc_sender, pk, sk)
-            sender_vk = sender_vk_bin.decode("ascii")
-            sender_pk = pysodium.crypto_sign_pk_to_box_pk(b58_to_bytes(sender_vk_bin))
-            cek = pysodium.crypto_box_open(encrypted_key, nonce, sender_pk, sk)
-        else:
-            sender_vk = None
-            cek = pysodium.crypto_box_seal_open(encrypted_key, pk, sk)
-        return cek, sender_vk, recip_vk_b58
-    raise ValueError("No corresponding recipient key found in {}".format(not_found))
+def _message_bytes(message: Union[str, bytes]) -> bytes:
+    """Return a message as UTF-8 bytes."""
+    if isinstance(message, str):
+        return message.encode("utf-8")
+    return message
 
 
 def encrypt_plaintext(
-        message: str, add_data: bytes, key: bytes
+        message: Union[str, bytes], add_data: bytes, key: bytes
 ) -> (bytes, bytes, bytes):
     """
     Encrypt the payload of a packed message.
 
     Args:
-        message: Message to encrypt
+        message: Message to encrypt; str is encoded as UTF-8
         add_data:
         key: Key used for encryption
 
     Returns:
         A tuple of (ciphertext, nonce, tag)
 
+    """
+    message_bin = _message_bytes(message)
+    output, nonce = _encrypt_payload(message_bin, add_data, key)
+    mlen = len(message_bin)
+    ciphertext = output[:mlen]
+    tag = output[mlen:]
+    return ciphertext, nonce, tag
+
+
+def _encrypt_payload(message_bin: bytes, add_data: bytes, key: bytes) -> (bytes, bytes):
+    """
+    Encrypt the payload of a packed message without splitting off the tag.
+
+    Returns:
+        A tuple of (ciphertext with tag appended, nonce)
+
     """
     nonce = pysodium.randombytes(pysodium.crypto_aead_chacha20poly1305_ietf_NPUBBYTES)
-    message_bin = message.encode("ascii")
     output = pysodium.crypto_aead_chacha20poly1305_ietf_encrypt(
         message_bin, add_data, nonce, key
     )
-    mlen = len(message)
-    ciphertext = output[:mlen]
-    tag = output[mlen:]
-    return ciphertext, nonce, tag
+    return output, nonce
 
 
 def decrypt_plaintext(
@@ -409,50 +700,185 @@ def decrypt_plaintext(
         key:
 
     Returns:
-        The decrypted string
+        The decrypted string, decoded as UTF-8
 
     """
-    output = pysodium.crypto_aead_chacha20poly1305_ietf_decrypt(
+    return pysodium.crypto_aead_chacha20poly1305_ietf_decrypt(
         ciphertext, recips_bin, nonce, key
-    )
-    return output.decode("ascii")
+    ).decode("utf-8")
 
 
 def pack_message(
-        message: str, to_verkeys: Sequence[bytes], from_verkey:bytes = None, from_sigkey: bytes = None
+        message: Union[str, bytes], to_verkeys: Sequence[bytes], from_verkey:bytes = None, from_sigkey: bytes = None,
+        shared_keys: MutableMapping = None, executor: Executor = None,
+        compression: str = None, compression_threshold: int = COMPRESSION_THRESHOLD
 ) -> bytes:
     """
     Assemble a packed message for a set of recipients, optionally including the sender.
 
     Args:
-        message: The message to pack
+        message: The message to pack, as bytes or a str to encode as UTF-8
         to_verkeys: The verkeys to pack the message for
         from_verkey: The sender verkey
         from_sigkey: The sender sigkey
+        shared_keys: Optional mapping of precomputed shared keys
+        executor: Optional thread pool to prepare recipients on in parallel
+        compression: Compress the payload with this algorithm (DEFLATE or
+            ZSTD) before encrypting it; the recipient must support it
+        compression_threshold: Smallest payload, in bytes, worth compressing
 
     Returns:
         The encoded message
 
     """
-    recips_json, cek = prepare_pack_recipient_keys(to_verkeys, from_verkey, from_sigkey)
-    recips_b64 = bytes_to_b64(recips_json.encode("ascii"), urlsafe=True)
+    message_bin, zip_alg = _maybe_compress(
+        _message_bytes(message), compression, compression_threshold
+    )
+    recips_b64, nonce, output = _encrypt_for_recipients(
+        message_bin, to_verkeys, from_verkey, from_sigkey, shared_keys, executor, zip_alg
+    )
+    output = memoryview(output)
+    mlen = len(output) - pysodium.crypto_aead_chacha20poly1305_ietf_ABYTES
+
+    return b"".join((
+        b'{"protected": "', recips_b64,
+        b'", "iv": "', base64.urlsafe_b64encode(nonce),
+        b'", "ciphertext": "', base64.urlsafe_b64encode(output[:mlen]),
+        b'", "tag": "', base64.urlsafe_b64encode(output[mlen:]),
+        b'"}',
+    ))
+
+
+def _encrypt_for_recipients(
+        message_bin: bytes, to_verkeys: Sequence[bytes], from_verkey: bytes,
+        from_sigkey: bytes, shared_keys: MutableMapping, executor: Executor = None,
+        zip_alg: str = None
+) -> (bytes, bytes, bytes):
+    """
+    Encrypt a payload for a set of recipients.
 
-    ciphertext, nonce, tag = encrypt_plaintext(message, recips_b64.encode("ascii"), cek)
+    Returns:
+        A tuple of (base64 protected header, nonce, ciphertext with tag appended)
 
-    data = OrderedDict(
-        [
-            ("protected", recips_b64),
-            ("iv", bytes_to_b64(nonce, urlsafe=True)),
-            ("ciphertext", bytes_to_b64(ciphertext, urlsafe=True)),
-            ("tag", bytes_to_b64(tag, urlsafe=True)),
-        ]
+    """
+    recips_json, cek = prepare_pack_recipient_keys(
+        to_verkeys, from_verkey, from_sigkey, shared_keys, executor, zip_alg
+    )
+    # The base64 protected header is both the AAD and part of the envelope;
+    # keep it as bytes and write the envelope directly, matching json.dumps
+    recips_b64 = base64.urlsafe_b64encode(recips_json.encode("ascii"))
+    output, nonce = _encrypt_payload(message_bin, recips_b64, cek)
+    return recips_b64, nonce, output
+
+
+def pack_message_chunks(
+        message: Union[str, bytes], to_verkeys: Sequence[bytes], from_verkey: bytes = None,
+        from_sigkey: bytes = None, shared_keys: MutableMapping = None, chunk_size: int = 65536,
+        compression: str = None, compression_threshold: int = COMPRESSION_THRESHOLD
+) -> Iterator[bytes]:
+    """
+    Assemble a packed message as a sequence of byte strings.
+
+    The payload is encrypted in one piece, in place in a single buffer, and
+    the ciphertext is base64 encoded `chunk_size` bytes at a time, so the
+    encoded envelope is never held in memory at once. Joined, the chunks equal the output of
+    `pack_message`.
+
+    Args:
+        message: The message to pack, as bytes or a str to encode as UTF-8
+        to_verkeys: The verkeys to pack the message for
+        from_verkey: The sender verkey
+        from_sigkey: The sender sigkey
+        shared_keys: Optional mapping of precomputed shared keys
+        chunk_size: Bytes of ciphertext encoded per chunk
+        compression: Compression algorithm, as for `pack_message`
+        compression_threshold: Smallest payload, in bytes, worth compressing
+
+    Returns:
+        An iterator over the encoded message
+
+    """
+    zip_alg = None
+    if compression is not None:
+        message, zip_alg = _maybe_compress(
+            _message_bytes(message), compression, compression_threshold
+        )
+    recips_json, cek = prepare_pack_recipient_keys(
+        to_verkeys, from_verkey, from_sigkey, shared_keys, zip_alg=zip_alg
     )
-    return json.dumps(data).encode("ascii")
+    recips_b64 = base64.urlsafe_b64encode(recips_json.encode("ascii"))
+    if isinstance(message, str):
+        payload = bytearray(message, "utf-8")
+    else:
+        payload = bytearray(message)
+    nonce, tag = _encrypt_in_place(payload, recips_b64, cek)
+    payload = memoryview(payload)
+    # Encode whole 3 byte groups so no padding appears mid-stream
+    chunk_size = max(3, chunk_size - chunk_size % 3)
+
+    yield b'{"protected": "' + recips_b64 + b'", "iv": "' \
+        + base64.urlsafe_b64encode(nonce) + b'", "ciphertext": "'
+    for start in range(0, len(payload), chunk_size):
+        yield base64.urlsafe_b64encode(payload[start:start + chunk_size])
+    yield b'", "tag": "' + base64.urlsafe_b64encode(tag) + b'"}'
+
+
+def pack_messages(
+        messages: Iterable[Union[str, bytes]], to_verkeys: Sequence[bytes], from_verkey: bytes = None,
+        from_sigkey: bytes = None, shared_keys: MutableMapping = None,
+        executor: Executor = None, chunksize: int = 1,
+        compression: str = None, compression_threshold: int = COMPRESSION_THRESHOLD
+) -> List[bytes]:
+    """
+    Assemble packed messages for a set of recipients from many messages.
+
+    Every message still receives its own content encryption key and
+    recipients block; the work shared between messages (key conversions and,
+    for Authcrypt, the crypto_box shared keys) is computed once for the batch.
+
+    Args:
+        messages: The messages to pack
+        to_verkeys: The verkeys to pack the messages for
+        from_verkey: The sender verkey
+        from_sigkey: The sender sigkey
+        shared_keys: Optional mapping of precomputed shared keys
+        executor: Optional thread or process pool to pack messages in
+        chunksize: Messages submitted per task when using a process pool
+        compression: Compression algorithm, as for `pack_message`
+        compression_threshold: Smallest payload, in bytes, worth compressing
+
+    Returns:
+        The encoded messages, in the order given
+
+    """
+    if shared_keys is None and from_verkey is not None:
+        shared_keys = {}
+
+    pack = partial(
+        pack_message,
+        to_verkeys=list(to_verkeys),
+        from_verkey=from_verkey,
+        from_sigkey=from_sigkey,
+        shared_keys=shared_keys,
+        compression=compression,
+        compression_threshold=compression_threshold
+    )
+    if executor is None:
+        return [pack(message) for message in messages]
+
+    if from_verkey is not None:
+        # Compute shared keys up front so every worker starts warm
+        for target_vk in to_verkeys:
+            shared_key(shared_keys, from_verkey, from_sigkey, target_vk)
+
+    return list(executor.map(pack, messages, chunksize=chunksize))
 
 
 def unpack_message(
-        enc_message: bytes, my_verkey: bytes, my_sigkey: bytes
-) -> (str, Optional[str], str):
+        enc_message: bytes, my_verkey: bytes = None, my_sigkey: bytes = None,
+        shared_keys: MutableMapping = None, keyring: Mapping[str, Tuple[bytes, bytes]] = None,
+        as_bytes: bool = False
+) -> (Union[str, bytes], Optional[str], str):
     """
     Decode a packed message.
 
@@ -462,7 +888,12 @@ def unpack_message(
 
     Args:
         enc_message: The encrypted message
-        find_key: Function to retrieve private key
+        my_verkey: Our verkey
+        my_sigkey: Our sigkey
+        shared_keys: Optional mapping of precomputed shared keys
+        keyring: Mapping of kid to (verkey, sigkey) to use instead of a
+            single verkey and sigkey (see `create_keyring`)
+        as_bytes: Return the message as bytes rather than decoding it as UTF-8
 
     Returns:
         A tuple of (message, sender_vk, recip_vk)
@@ -475,14 +906,44 @@ def unpack_message(
 
     """
     try:
-        wrapper = json.loads(enc_message)
+        wrapper = json_loads(enc_message)
     except Exception as err:
         raise ValueError("Invalid packed message") from err
 
     protected_bin = wrapper["protected"].encode("ascii")
-    recips_json = b64_to_bytes(wrapper["protected"], urlsafe=True).decode("ascii")
+    cek, sender_vk, recip_vk, zip_alg = _open_protected(
+        protected_bin, my_verkey, my_sigkey, shared_keys, keyring
+    )
+
+    ciphertext = b64_to_bytes(wrapper["ciphertext"], urlsafe=True)
+    nonce = b64_to_bytes(wrapper["iv"], urlsafe=True)
+    tag = b64_to_bytes(wrapper["tag"], urlsafe=True)
+
+    message = pysodium.crypto_aead_chacha20poly1305_ietf_decrypt_detached(
+        ciphertext, tag, protected_bin, nonce, cek
+    )
+    if zip_alg is not None:
+        message = decompress_payload(message, zip_alg)
+    if not as_bytes:
+        message = message.decode("utf-8")
+
+    return message, sender_vk, recip_vk
+
+
+def _open_protected(
+        protected_bin: bytes, my_verkey: bytes, my_sigkey: bytes,
+        shared_keys: MutableMapping, keyring: Mapping[str, Tuple[bytes, bytes]]
+) -> (bytes, Optional[str], str, Optional[str]):
+    """
+    Find our recipient entry in a protected header and recover the CEK.
+
+    Returns:
+        A tuple of (cek, sender_vk, recip_vk, zip), where zip is the
+        payload compression algorithm or None
+
+    """
     try:
-        recips_outer = json.loads(recips_json)
+        recips_outer = json_loads(base64.urlsafe_b64decode(protected_bin))
     except Exception as err:
         raise ValueError("Invalid packed message recipients") from err
 
@@ -491,16 +952,209 @@ def unpack_message(
     if not is_authcrypt and alg != "Anoncrypt":
         raise ValueError("Unsupported pack algorithm: {}".format(alg))
     cek, sender_vk, recip_vk = locate_pack_recipient_key(
-        recips_outer["recipients"], my_verkey, my_sigkey
+        recips_outer["recipients"], my_verkey, my_sigkey, shared_keys, keyring
     )
     if not sender_vk and is_authcrypt:
         raise ValueError("Sender public key not provided for Authcrypt message")
+    zip_alg = recips_outer.get("zip")
+    if zip_alg is not None and zip_alg not in compression_algorithms():
+        raise ValueError("Unsupported compression algorithm: {}".format(zip_alg))
+    return cek, sender_vk, recip_vk, zip_alg
+
+
+class EnvelopeReader:
+    """
+    Incremental parser for the JSON envelope of a packed message.
+
+    Feed the envelope in chunks of any size with `feed` and finish with
+    `close`. The ciphertext is base64 decoded as it arrives into a single
+    buffer, which `unpack_envelope` then decrypts in place; the other fields
+    are collected as they arrive, up to `max_field_size` bytes each. Every
+    field of the envelope must be a string, as produced by `pack_message`.
+    """
+    _FIELD = re.compile(rb'\s*[{,]\s*"([^"\\]*)"\s*:\s*"')
+    # Longest run of input between field values (keys, separators, whitespace)
+    MAX_PENDING = 65536
+    MAX_FIELD_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, max_field_size: int = MAX_FIELD_SIZE):
+        self.max_field_size = max_field_size
+        self.fields = {}
+        self.ciphertext = bytearray()
+        self._pending = b""
+        self._field = None
+        self._value = None
+        self._carry = b""
+
+    def __len__(self):
+        return len(self.ciphertext)
+
+    def feed(self, chunk: bytes):
+        """Parse the next chunk of the envelope."""
+        data = self._pending + bytes(chunk) if self._pending else bytes(chunk)
+        pos = 0
+        while True:
+            if self._field is None:
+                match = self._FIELD.match(data, pos)
+                if not match:
+                    break
+                self._field = match.group(1)
+                if self._field != b"ciphertext":
+                    self._value = bytearray()
+                pos = match.end()
+
+            end = data.find(b'"', pos)
+            stop = len(data) if end < 0 else end
+            if self._field == b"ciphertext":
+                self._decode(data[pos:stop])
+            else:
+                self._value += data[pos:stop]
+                if len(self._value) > self.max_field_size:
+                    raise ValueError("Packed message field too large")
+            pos = stop
+            if end < 0:
+                break
+            if self._field != b"ciphertext":
+                self.fields[self._field.decode("ascii")] = bytes(self._value)
+                self._value = None
+            self._field = None
+            pos = end + 1
+
+        self._pending = data[pos:]
+        if len(self._pending) > self.MAX_PENDING:
+            raise ValueError("Invalid packed message")
+
+    def _decode(self, data: bytes):
+        data = self._carry + data
+        usable = len(data) - len(data) % 4
+        self._carry = data[usable:]
+        if usable:
+            try:
+                self.ciphertext += base64.urlsafe_b64decode(data[:usable])
+            except Exception as err:
+                raise ValueError("Invalid packed message") from err
+
+    def close(self):
+        """Check that a complete envelope was read."""
+        if self._field is not None or self._carry or self._pending.strip() != b"}":
+            raise ValueError("Invalid packed message")
+        for field in ("protected", "iv", "tag"):
+            if field not in self.fields:
+                raise ValueError("Invalid packed message")
+
+
+def _encrypt_in_place(buffer: bytearray, add_data: bytes, key: bytes) -> (bytes, bytes):
+    """
+    Encrypt a payload held in a bytearray, replacing it with the ciphertext.
+
+    Returns:
+        A tuple of (nonce, tag)
+
+    """
+    if len(key) != pysodium.crypto_aead_chacha20poly1305_ietf_KEYBYTES:
+        raise ValueError("Invalid content encryption key")
+    nonce = pysodium.randombytes(pysodium.crypto_aead_chacha20poly1305_ietf_NPUBBYTES)
+    tag = ctypes.create_string_buffer(pysodium.crypto_aead_chacha20poly1305_ietf_ABYTES)
+    c_buffer = (ctypes.c_char * len(buffer)).from_buffer(buffer)
+    try:
+        result = pysodium.sodium.crypto_aead_chacha20poly1305_ietf_encrypt_detached(
+            c_buffer, tag, None, c_buffer, ctypes.c_ulonglong(len(buffer)),
+            add_data, ctypes.c_ulonglong(len(add_data)), None, nonce, key
+        )
+    finally:
+        del c_buffer
+    if result != 0:
+        raise CryptoError("Failed to encrypt message")
+    return nonce, tag.raw
 
-    ciphertext = b64_to_bytes(wrapper["ciphertext"], urlsafe=True)
-    nonce = b64_to_bytes(wrapper["iv"], urlsafe=True)
-    tag = b64_to_bytes(wrapper["tag"], urlsafe=True)
 
-    payload_bin = ciphertext + tag
-    message = decrypt_plaintext(payload_bin, protected_bin, nonce, cek)
+def _decrypt_in_place(
+        buffer: bytearray, tag: bytes, add_data: bytes, nonce: bytes, key: bytes
+):
+    """
+    Decrypt a ciphertext held in a bytearray, replacing it with the plaintext.
 
+    pysodium only takes and returns immutable bytes, so call libsodium's
+    detached functions directly with the buffer as both input and output.
+    """
+    if len(tag) != pysodium.crypto_aead_chacha20poly1305_ietf_ABYTES:
+        raise ValueError("Invalid packed message tag")
+    if len(nonce) != pysodium.crypto_aead_chacha20poly1305_ietf_NPUBBYTES:
+        raise ValueError("Invalid packed message nonce")
+    # The key is recovered from the sender's encrypted_key, so check it
+    # before libsodium reads a full key's worth of bytes from it
+    if len(key) != pysodium.crypto_aead_chacha20poly1305_ietf_KEYBYTES:
+        raise ValueError("Invalid content encryption key")
+    c_buffer = (ctypes.c_char * len(buffer)).from_buffer(buffer)
+    try:
+        result = pysodium.sodium.crypto_aead_chacha20poly1305_ietf_decrypt_detached(
+            c_buffer, None, c_buffer, ctypes.c_ulonglong(len(buffer)), tag,
+            add_data, ctypes.c_ulonglong(len(add_data)), nonce, key
+        )
+    finally:
+        del c_buffer
+    if result != 0:
+        raise ValueError("Failed to decrypt packed message")
+
+
+def unpack_envelope(
+        envelope: EnvelopeReader, my_verkey: bytes = None, my_sigkey: bytes = None,
+        shared_keys: MutableMapping = None, keyring: Mapping[str, Tuple[bytes, bytes]] = None
+) -> (bytearray, Optional[str], str):
+    """
+    Decrypt a packed message read with an EnvelopeReader.
+
+    The ciphertext buffer is decrypted in place and returned as the message,
+    so no further copy of the payload is made unless it was compressed. The
+    message is returned as a bytearray (bytes if decompressed), which the
+    JSON loaders accept directly.
+
+    Returns:
+        A tuple of (message, sender_vk, recip_vk)
+
+    """
+    protected_bin = envelope.fields["protected"]
+    cek, sender_vk, recip_vk, zip_alg = _open_protected(
+        protected_bin, my_verkey, my_sigkey, shared_keys, keyring
+    )
+    nonce = b64_to_bytes(envelope.fields["iv"], urlsafe=True)
+    tag = b64_to_bytes(envelope.fields["tag"], urlsafe=True)
+
+    message = envelope.ciphertext
+    _decrypt_in_place(message, tag, protected_bin, nonce, cek)
+    if zip_alg is not None:
+        message = decompress_payload(message, zip_alg)
     return message, sender_vk, recip_vk
+
+
+def unpack_message_stream(
+        stream, my_verkey: bytes = None, my_sigkey: bytes = None,
+        shared_keys: MutableMapping = None, keyring: Mapping[str, Tuple[bytes, bytes]] = None,
+        chunk_size: int = 65536
+) -> (bytearray, Optional[str], str):
+    """
+    Decode a packed message read from a file or an iterable of byte strings.
+
+    Peak memory stays near one copy of the payload, instead of the several
+    copies made by `unpack_message`. Decryption itself is still done in one
+    piece, as the AEAD tag covers the whole ciphertext.
+
+    Args:
+        stream: A binary file object, or an iterable of byte strings
+        my_verkey: Our verkey
+        my_sigkey: Our sigkey
+        shared_keys: Optional mapping of precomputed shared keys
+        keyring: Mapping of kid to (verkey, sigkey) (see `create_keyring`)
+        chunk_size: Bytes read from a file at a time
+
+    Returns:
+        A tuple of (message, sender_vk, recip_vk), with the message as a bytes-like object
+
+    """
+    if hasattr(stream, "read"):
+        stream = iter(partial(stream.read, chunk_size), b"")
+    envelope = EnvelopeReader()
+    for chunk in stream:
+        envelope.feed(chunk)
+    envelope.close()
+    return unpack_envelope(envelope, my_verkey, my_sigkey, shared_keys, keyring)
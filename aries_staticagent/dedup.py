@@ -0,0 +1,129 @@
+""" Replay protection for inbound messages """
+from collections import OrderedDict
+import sqlite3
+import threading
+import time
+
+class ReplayCache:
+    """ Remember recently handled messages by (sender verkey, @id).
+
+        Entries expire after `ttl` seconds; when more than `maxsize` are
+        held, the oldest are evicted first. A message seen again after its
+        entry was evicted or expired is handled again.
+    """
+    def __init__(self, maxsize: int = 10000, ttl: float = 600.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict() # key to expiry
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def seen(self, sender_vk, msg_id) -> bool:
+        """ Record a message, returning True if it was already recorded. """
+        key = (sender_vk, msg_id)
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            if key in self._entries:
+                return True
+            self._entries[key] = now + self.ttl
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return False
+
+    def forget(self, sender_vk, msg_id):
+        """ Remove a recorded message so it is handled if seen again. """
+        with self._lock:
+            self._entries.pop((sender_vk, msg_id), None)
+
+    def _expire(self, now):
+        # Entries are inserted in expiry order, so stop at the first live one
+        while self._entries:
+            key, expires = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class SQLiteReplayCache(ReplayCache):
+    """ ReplayCache persisted to a SQLite database so it survives restarts.
+
+        Expiry uses wall-clock time, since monotonic time does not carry
+        across processes. Each message costs one short transaction; expired
+        entries are purged every `purge_interval` seconds and the oldest
+        entries are evicted only once there are more than `maxsize`.
+    """
+    def __init__(
+            self, path: str, maxsize: int = 10000, ttl: float = 600.0, clock=time.time,
+            purge_interval: float = 60.0):
+        super().__init__(maxsize, ttl, clock)
+        self.path = path
+        self.purge_interval = purge_interval
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS seen ('
+            ' sender TEXT NOT NULL,'
+            ' id TEXT NOT NULL,'
+            ' expires REAL NOT NULL,'
+            ' PRIMARY KEY (sender, id))'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS seen_expires ON seen (expires)')
+        self._count = self._db.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+        self._next_purge = 0.0
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+    def seen(self, sender_vk, msg_id) -> bool:
+        now = self.clock()
+        with self._lock, self._db:
+            self._db.execute('BEGIN')
+            if now >= self._next_purge:
+                self._count -= self._db.execute(
+                    'DELETE FROM seen WHERE expires <= ?', (now,)
+                ).rowcount
+                self._next_purge = now + self.purge_interval
+
+            # An entry that expired since the last purge no longer counts
+            self._count -= self._db.execute(
+                'DELETE FROM seen WHERE sender = ? AND id = ? AND expires <= ?',
+                (sender_vk or '', msg_id, now)
+            ).rowcount
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO seen (sender, id, expires) VALUES (?, ?, ?)',
+                (sender_vk or '', msg_id, now + self.ttl)
+            )
+            if cursor.rowcount == 0:
+                return True
+            self._count += 1
+            if self._count > self.maxsize:
+                self._count -= self._db.execute(
+                    'DELETE FROM seen WHERE rowid IN ('
+                    ' SELECT rowid FROM seen ORDER BY expires LIMIT ?)',
+                    (self._count - self.maxsize,)
+                ).rowcount
+            return False
+
+    def forget(self, sender_vk, msg_id):
+        with self._lock:
+            self._count -= self._db.execute(
+                'DELETE FROM seen WHERE sender = ? AND id = ?', (sender_vk or '', msg_id)
+            ).rowcount
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM seen')
+            self._count = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
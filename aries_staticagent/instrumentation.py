@@ -0,0 +1,171 @@
+""" Timing and counting hooks for the message hot paths.
+
+    Agent and StaticAgentConnection report to an Instrumentation instance.
+    The default, NOOP, discards everything. InMemoryInstrumentation keeps
+    histograms and counters that can be read with `snapshot()` or exported
+    in Prometheus text format with `prometheus_text()`.
+
+    Timers: unpack, deserialize, route_resolution, handler, serialize, pack,
+    pack_batch (send_many and queued sends), send.
+    Counters: messages, no_route and duplicates (by type), errors (by
+    stage). The type label names the route a message matched rather than
+    its @type, with module routes named by the module's version; types
+    without a route are counted under OTHER. The number of label values is
+    thus bounded by the routes registered.
+"""
+import bisect
+from collections import defaultdict
+import threading
+import time
+
+class _Timer:
+    """ Context manager reporting elapsed time to an Instrumentation. """
+    __slots__ = ('instrumentation', 'name', 'start')
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.instrumentation.observe(self.name, time.perf_counter() - self.start)
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+class Instrumentation:
+    """ Instrumentation interface; every hook is a no-op. """
+    def timer(self, name: str):
+        """ Return a context manager timing the enclosed block as `name`. """
+        return _NULL_TIMER
+
+    def observe(self, name: str, seconds: float):
+        """ Record a duration. """
+
+    def count(self, name: str, label: str = None, value: int = 1):
+        """ Increment a counter, optionally for one label value. """
+
+NOOP = Instrumentation()
+
+# Label for message types that are not routed
+OTHER = 'other'
+
+class Histogram:
+    """ Cumulative histogram with fixed bucket upper bounds. """
+    DEFAULT_BUCKETS = (
+        0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+        0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+    )
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ Return [(upper bound, cumulative count)], ending with +Inf. """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+class InMemoryInstrumentation(Instrumentation):
+    """ Keep timings in histograms and counts in memory. """
+    def __init__(self, buckets=Histogram.DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def timer(self, name: str):
+        return _Timer(self, name)
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(self.buckets)
+            self.histograms[name].observe(seconds)
+
+    def count(self, name: str, label: str = None, value: int = 1):
+        with self._lock:
+            self.counters[name][label] += value
+
+    def snapshot(self):
+        """ Return histograms and counters as plain dictionaries. """
+        with self._lock:
+            return {
+                'timers': {
+                    name: {
+                        'count': histogram.count,
+                        'sum': histogram.sum,
+                        'buckets': histogram.cumulative(),
+                    }
+                    for name, histogram in self.histograms.items()
+                },
+                'counters': {
+                    name: dict(labels) for name, labels in self.counters.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+LABELS = {
+    'messages': 'type',
+    'no_route': 'type',
+    'duplicates': 'type',
+    'errors': 'stage',
+}
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+def prometheus_text(instrumentation: InMemoryInstrumentation, prefix='aries_staticagent') -> str:
+    """ Export an InMemoryInstrumentation in Prometheus text format. """
+    snapshot = instrumentation.snapshot()
+    lines = []
+    for name, timer in sorted(snapshot['timers'].items()):
+        metric = '{}_{}_seconds'.format(prefix, name)
+        lines.append('# TYPE {} histogram'.format(metric))
+        for bound, count in timer['buckets']:
+            lines.append('{}_bucket{{le="{}"}} {}'.format(metric, _format_bound(bound), count))
+        lines.append('{}_sum {}'.format(metric, repr(timer['sum'])))
+        lines.append('{}_count {}'.format(metric, timer['count']))
+
+    for name, labels in sorted(snapshot['counters'].items()):
+        metric = '{}_{}_total'.format(prefix, name)
+        label_name = LABELS.get(name, 'label')
+        lines.append('# TYPE {} counter'.format(metric))
+        for label, value in sorted(labels.items(), key=lambda item: str(item[0])):
+            if label is None:
+                lines.append('{} {}'.format(metric, value))
+            else:
+                lines.append('{}{{{}="{}"}} {}'.format(
+                    metric, label_name, _escape(str(label)), value
+                ))
+    return '\n'.join(lines) + '\n'
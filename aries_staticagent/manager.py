@@ -0,0 +1,141 @@
+""" Static Agent Connection Manager """
+from concurrent.futures import Executor
+import asyncio
+import functools
+import logging
+
+import aiohttp
+
+from .connection import StaticAgentConnection
+from .dedup import ReplayCache
+from .instrumentation import NOOP
+from .session import SessionPool
+from . import crypto
+
+class UnknownConnectionException(Exception):
+    """ Thrown when an inbound message is not for any managed connection """
+
+class StaticAgentConnectionManager:
+    """ Hold many static connections and route inbound messages to them.
+
+        Connections are indexed by their verkey (kid). Inbound messages are
+        unpacked once against a keyring of every managed key and handed to the
+        matching connection. All connections share one pooled HTTP session and
+        one table of precomputed shared keys, and connections created with
+        `connect` share `replay_cache`.
+    """
+    def __init__(
+            self,
+            *,
+            session: aiohttp.ClientSession = None,
+            pool_limit: int = 100,
+            pool_limit_per_host: int = 0,
+            keepalive_timeout: float = 30.0,
+            precompute_shared_keys: bool = False,
+            executor: Executor = None,
+            inline_threshold: int = 0,
+            instrumentation=NOOP,
+            replay_cache: ReplayCache = None):
+        self.connections = {} # kid to connection
+        self.keyring = {} # kid to (verkey, sigkey)
+        self.executor = executor
+        self.inline_threshold = inline_threshold
+        self.instrumentation = instrumentation
+        self.replay_cache = replay_cache
+        self.logger = logging.getLogger(__name__)
+
+        self._shared_keys = crypto.SharedKeyCache() if precompute_shared_keys else None
+        self._pool = SessionPool(session, pool_limit, pool_limit_per_host, keepalive_timeout)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """ Return the HTTP session shared by all connections. """
+        return self._pool.session
+
+    async def close(self):
+        """ Close every managed connection, then the shared HTTP session if
+            owned by this manager.
+        """
+        for conn in list(self.connections.values()):
+            await conn.close()
+        await self._pool.close()
+
+    def connect(self, endpoint, their_vk, my_vk, my_sk) -> StaticAgentConnection:
+        """ Create a managed connection. """
+        conn = StaticAgentConnection(
+            endpoint, their_vk, my_vk, my_sk,
+            executor=self.executor,
+            inline_threshold=self.inline_threshold,
+            instrumentation=self.instrumentation,
+            replay_cache=self.replay_cache
+        )
+        self.add(conn)
+        return conn
+
+    def add(self, conn: StaticAgentConnection):
+        """ Add an existing connection to the manager.
+
+            The connection is switched over to the manager's shared session and
+            shared key table.
+        """
+        kid = crypto.bytes_to_b58(conn.my_vk)
+        if kid in self.connections and self.connections[kid] is not conn:
+            raise ValueError('A connection for {} is already managed'.format(kid))
+
+        conn._manager = self
+        conn._shared_keys = self._shared_keys
+        self.connections[kid] = conn
+        self.keyring[kid] = (conn.my_vk, conn.my_sk)
+
+    def remove(self, conn: StaticAgentConnection):
+        """ Stop managing a connection. """
+        kid = crypto.bytes_to_b58(conn.my_vk)
+        if self.connections.get(kid) is conn:
+            del self.connections[kid]
+            del self.keyring[kid]
+            conn._manager = None
+
+    def get(self, verkey) -> StaticAgentConnection:
+        """ Return the connection for a verkey (bytes or base 58), if any. """
+        if isinstance(verkey, bytes):
+            verkey = crypto.bytes_to_b58(verkey)
+        return self.connections.get(verkey)
+
+    async def handle(self, packed_message):
+        """ Unpack a message once and dispatch it to its connection. """
+        unpack = functools.partial(
+            crypto.unpack_message,
+            packed_message,
+            shared_keys=self._shared_keys,
+            keyring=self.keyring,
+            as_bytes=True
+        )
+        try:
+            with self.instrumentation.timer('unpack'):
+                if self.executor is None or len(packed_message) < self.inline_threshold:
+                    msg, sender_vk, recip_vk = unpack()
+                else:
+                    msg, sender_vk, recip_vk = await asyncio.get_event_loop().run_in_executor(
+                        self.executor, unpack
+                    )
+        except Exception:
+            self.instrumentation.count('errors', 'unpack')
+            raise
+
+        conn = self.connections.get(recip_vk)
+        if conn is None:
+            raise UnknownConnectionException(
+                'No connection for recipient {}'.format(recip_vk)
+            )
+        if sender_vk != crypto.bytes_to_b58(conn.their_vk):
+            raise UnknownConnectionException(
+                'Message for {} not sent by its counterpart'.format(recip_vk)
+            )
+
+        await conn._handle_unpacked(msg, sender_vk, recip_vk)
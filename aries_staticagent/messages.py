@@ -1,26 +1,130 @@
 from collections import UserDict
+from collections.abc import MutableMapping
+from functools import lru_cache
 import json
 import re
+from typing import Union
 import uuid
 
 from .module import Semver
+from .utils import json_dumps, json_loads
 
 class InvalidMessageType(Exception): pass
 
-class Message(UserDict):
+TYPE_CACHE_SIZE = 256
+
+def _parse_type(message_type_uri):
+    """ Parse a message type URI into
+        (doc_uri, protocol, version, short_type, version_info).
+    """
+    doc_uri, protocol, version, short_type = Message.parse_type_info(message_type_uri)
+    try:
+        version_info = Semver.from_str(version)
+    except ValueError as err:
+        raise InvalidMessageType('Invalid message type version') from err
+    return doc_uri, protocol, version, short_type, version_info
+
+_cached_parse_type = lru_cache(maxsize=TYPE_CACHE_SIZE)(_parse_type)
+
+def set_type_cache_size(maxsize):
+    """ Resize (and clear) the cache of parsed message types. """
+    global _cached_parse_type
+    _cached_parse_type = lru_cache(maxsize=maxsize)(_parse_type)
+
+def type_cache_info():
+    """ Return hits, misses, maxsize and currsize of the parsed type cache. """
+    return _cached_parse_type.cache_info()
+
+class Message(MutableMapping):
+    """ A DIDComm message.
+
+        Behaves like a UserDict over `data`, though it is not an instance of
+        one. Type information is parsed from
+        `@type` on first access and an `@id` is only generated when it is
+        first needed, usually at serialization.
+    """
+    __slots__ = ('data', '_type_info', 'raw')
+
     MTURI_RE = re.compile(r'(.*?)([a-z0-9._-]+)/(\d[^/]*)/([a-z0-9._-]+)$')
 
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.doc_uri, self.protocol, self.version, self.short_type = \
-                Message.parse_type_info(self.type)
-        try:
-            self.version_info = Semver.from_str(self.version)
-        except ValueError as err:
-            raise InvalidMessageType('Invalid message type version') from err
+        self.data = dict(*args, **kwargs)
+        self._type_info = None
+        self.raw = None
 
-        if '@id' not in self.data:
-            self.data['@id'] = str(uuid.uuid4())
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        if key == '@type':
+            self._type_info = None
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        if key == '@type':
+            self._type_info = None
+        del self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __repr__(self):
+        return repr(self.data)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def _with_data(self, data):
+        """ Return a message of the same class holding `data`. """
+        # Bypass __init__, which subclasses such as Noop override
+        msg = type(self).__new__(type(self))
+        msg.data = data
+        msg._type_info = None
+        msg.raw = None
+        return msg
+
+    def copy(self):
+        msg = self._with_data(dict(self.data))
+        msg._type_info = self._type_info
+        return msg
+
+    @classmethod
+    def fromkeys(cls, iterable, value=None):
+        msg = cls()
+        for key in iterable:
+            msg[key] = value
+        return msg
+
+    def __or__(self, other):
+        if isinstance(other, (Message, UserDict)):
+            return self._with_data({**self.data, **other.data})
+        if isinstance(other, dict):
+            return self._with_data({**self.data, **other})
+        return NotImplemented
+
+    def __ror__(self, other):
+        if isinstance(other, (Message, UserDict)):
+            return self._with_data({**other.data, **self.data})
+        if isinstance(other, dict):
+            return self._with_data({**other, **self.data})
+        return NotImplemented
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    @property
+    def type_info(self):
+        """ (doc_uri, protocol, version, short_type, version_info) """
+        if self._type_info is None:
+            self._type_info = _cached_parse_type(self.type)
+        return self._type_info
 
     @property
     def type(self):
@@ -28,7 +132,29 @@ class Message(UserDict):
 
     @property
     def id(self):
-        return self['@id']
+        if '@id' not in self.data:
+            self.data['@id'] = str(uuid.uuid4())
+        return self.data['@id']
+
+    @property
+    def doc_uri(self):
+        return self.type_info[0]
+
+    @property
+    def protocol(self):
+        return self.type_info[1]
+
+    @property
+    def version(self):
+        return self.type_info[2]
+
+    @property
+    def short_type(self):
+        return self.type_info[3]
+
+    @property
+    def version_info(self):
+        return self.type_info[4]
 
     @property
     def qualified_protocol(self):
@@ -43,15 +169,32 @@ class Message(UserDict):
         return matches.groups()
 
     @staticmethod
-    def deserialize(serialized: str):
-        return Message(json.loads(serialized))
+    def deserialize(serialized: Union[str, bytes], keep_raw: bool = False):
+        """ Parse a message from JSON text or UTF-8 bytes.
+
+            With `keep_raw`, the serialized form is kept as `msg.raw`.
+        """
+        # Adopt the parsed dict rather than copying it
+        msg = Message.__new__(Message)
+        msg.data = json_loads(serialized)
+        msg._type_info = None
+        msg.raw = serialized if keep_raw else None
+        return msg
 
-    def serialize(self):
+    def serialize(self, as_bytes: bool = False):
+        """ Serialize to a JSON string, or to compact UTF-8 JSON bytes
+            ready for packing with `as_bytes`.
+        """
+        if '@id' not in self.data:
+            self.data['@id'] = str(uuid.uuid4())
+        if as_bytes:
+            return json_dumps(self.data)
         return json.dumps(self.data)
 
 
 class Noop(Message):
     """ noop message """
+    __slots__ = ()
     TYPE = 'did:none:0000000000000000/noop/1.0/noop'
     def __init__(self, **kwargs):
         return_route = kwargs.get('return_route', False)
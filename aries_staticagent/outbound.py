@@ -0,0 +1,163 @@
+""" Outbound message queue """
+import asyncio
+import logging
+import random
+
+import aiohttp
+
+class OutboundQueueFullException(Exception):
+    """ Thrown when a message is submitted to a full outbound queue """
+
+def is_retryable(err: Exception) -> bool:
+    """ Return whether a failed delivery is worth retrying. """
+    if isinstance(err, aiohttp.ClientResponseError):
+        return err.status >= 500
+    return isinstance(
+        err, (aiohttp.ClientConnectionError, ConnectionError, asyncio.TimeoutError)
+    )
+
+class OutboundQueue:
+    """ Bounded queue of outbound messages delivered by a background sender.
+
+        Queued messages are coalesced into batches of up to `batch_size` and
+        packed together with `pack` (a coroutine taking a list of serialized
+        messages and returning the packed messages in order). Each packed
+        message is then delivered with `post`, with at most `concurrency`
+        deliveries in flight. Connection errors and 5xx responses are retried
+        with exponential backoff up to `max_retries` times; messages that
+        still fail are passed to `on_error(packed_message, err)`.
+
+        Whatever `post` returns for a delivered message, other than None, is
+        passed to `on_response` (a coroutine). It runs after delivery has
+        succeeded, so its errors are logged and never cause a resend.
+    """
+    def __init__(
+            self,
+            pack,
+            post,
+            *,
+            concurrency: int = 4,
+            maxsize: int = 1000,
+            batch_size: int = 32,
+            max_retries: int = 5,
+            backoff: float = 0.5,
+            max_backoff: float = 30.0,
+            on_error=None,
+            on_response=None):
+        self.pack = pack
+        self.post = post
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_error = on_error
+        self.on_response = on_response
+        self.logger = logging.getLogger(__name__)
+
+        self._queue = None
+        self._sender = None
+        self._slots = None
+        self._deliveries = set()
+
+    @property
+    def running(self):
+        return self._sender is not None
+
+    def start(self):
+        """ Start the background sender on the running loop. """
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._sender = asyncio.ensure_future(self._send_loop())
+
+    def submit(self, serialized):
+        """ Queue a serialized message for delivery without waiting. """
+        if not self.running:
+            self.start()
+        try:
+            self._queue.put_nowait(serialized)
+        except asyncio.QueueFull:
+            raise OutboundQueueFullException('Outbound queue is full') from None
+
+    def qsize(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def flush(self):
+        """ Wait until every queued message has been delivered or given up on. """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self, drain: bool = True):
+        """ Stop the sender, first delivering queued messages if `drain`. """
+        if not self.running:
+            return
+        if drain:
+            await self.flush()
+        self._sender.cancel()
+        for task in self._deliveries:
+            task.cancel()
+        await asyncio.gather(self._sender, *self._deliveries, return_exceptions=True)
+        self._sender = None
+        self._queue = None
+        self._deliveries = set()
+
+    async def _send_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                packed_msgs = await self.pack(batch)
+            except Exception as err: # pylint: disable=broad-except
+                self.logger.exception('Failed to pack outbound messages')
+                for _ in batch:
+                    self._failed(None, err)
+                continue
+
+            for packed_msg in packed_msgs:
+                await self._slots.acquire()
+                task = asyncio.ensure_future(self._deliver(packed_msg))
+                self._deliveries.add(task)
+                task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, packed_msg):
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = await self.post(packed_msg)
+                    break
+                except Exception as err: # pylint: disable=broad-except
+                    if attempt >= self.max_retries or not is_retryable(err):
+                        self._failed(packed_msg, err)
+                        return
+                    delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                    delay *= random.uniform(0.5, 1.0)
+                    self.logger.debug(
+                        'Delivery failed (%s), retrying in %.2fs', err, delay
+                    )
+                    attempt += 1
+                    await asyncio.sleep(delay)
+
+            try:
+                if response is not None and self.on_response is not None:
+                    await self.on_response(response)
+            except Exception: # pylint: disable=broad-except
+                self.logger.exception('Failed to handle response to outbound message')
+            finally:
+                self._queue.task_done()
+        finally:
+            self._slots.release()
+
+    def _failed(self, packed_msg, err):
+        try:
+            if self.on_error:
+                self.on_error(packed_msg, err)
+            else:
+                self.logger.error('Failed to deliver outbound message: %s', err)
+        finally:
+            self._queue.task_done()
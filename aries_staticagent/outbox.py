@@ -0,0 +1,79 @@
+""" Durable outbound message store """
+import sqlite3
+import threading
+
+class Outbox:
+    """ Packed outbound messages kept in a SQLite file until delivered.
+
+        Messages are written before any delivery is attempted and removed
+        only once delivered, so a message survives an unreachable endpoint or
+        a crash and is delivered at least once. Entries are kept per endpoint
+        so one file can back several connections. Space freed by delivered
+        entries is returned to the filesystem by `compact()` once at least
+        `compact_pages` database pages are free.
+    """
+    def __init__(self, path: str, batch_size: int = 32, compact_pages: int = 256):
+        self.path = path
+        self.batch_size = batch_size
+        self.compact_pages = compact_pages
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # auto_vacuum only takes effect if set before the first table is made
+        self._db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' endpoint TEXT NOT NULL,'
+            ' message BLOB NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS outbox_endpoint ON outbox (endpoint, id)')
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def put(self, endpoint: str, packed_msgs):
+        """ Store packed messages for an endpoint in one transaction. """
+        with self._lock, self._db:
+            self._db.execute('BEGIN')
+            self._db.executemany(
+                'INSERT INTO outbox (endpoint, message) VALUES (?, ?)',
+                [(endpoint, packed_msg) for packed_msg in packed_msgs]
+            )
+
+    def pending(self, endpoint: str, limit: int = None):
+        """ Return up to `limit` undelivered [(id, packed message)], oldest first. """
+        with self._lock:
+            return [
+                (entry_id, bytes(message))
+                for entry_id, message in self._db.execute(
+                    'SELECT id, message FROM outbox WHERE endpoint = ? ORDER BY id LIMIT ?',
+                    (endpoint, limit or self.batch_size)
+                )
+            ]
+
+    def remove(self, entry_ids):
+        """ Remove delivered (or abandoned) entries. """
+        with self._lock, self._db:
+            self._db.execute('BEGIN')
+            self._db.executemany(
+                'DELETE FROM outbox WHERE id = ?', [(entry_id,) for entry_id in entry_ids]
+            )
+
+    def compact(self, force: bool = False):
+        """ Release the space held by removed entries, if enough is free or
+            `force` is set.
+        """
+        with self._lock:
+            free = self._db.execute('PRAGMA freelist_count').fetchone()[0]
+            if not force and free < self.compact_pages:
+                return
+            self._db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            # execute() steps the pragma once, freeing a single page;
+            # executescript() runs it to completion
+            self._db.executescript('PRAGMA incremental_vacuum')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
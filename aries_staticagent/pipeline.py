@@ -0,0 +1,75 @@
+""" Inbound message pipeline """
+import asyncio
+import logging
+
+class PipelineFullException(Exception):
+    """ Thrown when a message is submitted to a full pipeline """
+
+class InboundPipeline:
+    """ Bounded queue of inbound packed messages processed by worker tasks.
+
+        Messages are handed to `handler` (e.g. StaticAgentConnection.handle)
+        by a fixed number of workers. When the queue is full, `submit` raises
+        PipelineFullException so the transport can push back on the sender
+        (e.g. with 429 or 503) instead of buffering without bound.
+    """
+    def __init__(self, handler, workers: int = 4, maxsize: int = 100):
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.logger = logging.getLogger(__name__)
+
+        self._queue = None
+        self._tasks = []
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    def start(self):
+        """ Start worker tasks on the running loop. """
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [
+            asyncio.ensure_future(self._worker()) for _ in range(self.workers)
+        ]
+
+    def submit(self, packed_message):
+        """ Queue a packed message for handling without waiting. """
+        if not self.running:
+            self.start()
+        try:
+            self._queue.put_nowait(packed_message)
+        except asyncio.QueueFull:
+            raise PipelineFullException('Inbound queue is full') from None
+
+    def qsize(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def join(self):
+        """ Wait until every queued message has been handled. """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self, drain: bool = True):
+        """ Stop workers, first handling queued messages if `drain`. """
+        if not self.running:
+            return
+        if drain:
+            await self.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def _worker(self):
+        while True:
+            packed_message = await self._queue.get()
+            try:
+                await self.handler(packed_message)
+            except Exception: # pylint: disable=broad-except
+                self.logger.exception('Failed to handle inbound message')
+            finally:
+                self._queue.task_done()
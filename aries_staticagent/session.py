@@ -0,0 +1,40 @@
+""" Pooled HTTP session """
+import aiohttp
+
+class SessionPool:
+    """ A long-lived, pooled HTTP session created on first use.
+
+        A `session` passed in is shared with its creator and never closed
+        here; otherwise the session is created with a TCPConnector using the
+        given pool settings and closed by `close()`.
+    """
+    def __init__(
+            self,
+            session: aiohttp.ClientSession = None,
+            limit: int = 100,
+            limit_per_host: int = 0,
+            keepalive_timeout: float = 30.0):
+        self._session = session
+        self._owned = session is None
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """ Return the session, creating it if necessary. """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._owned = True
+        return self._session
+
+    async def close(self):
+        """ Close the session, if owned. """
+        if self._session is not None and self._owned and not self._session.closed:
+            await self._session.close()
+        self._session = None
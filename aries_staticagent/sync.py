@@ -0,0 +1,93 @@
+""" Synchronous facade over StaticAgentConnection """
+import asyncio
+from concurrent.futures import Future
+import threading
+
+from .connection import StaticAgentConnection
+
+class BackgroundLoop:
+    """ An event loop running forever in a daemon thread. """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run, name='aries-staticagent-loop', daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def submit(self, coro) -> Future:
+        """ Schedule a coroutine on the loop from any thread. """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        """ Stop the loop and wait for its thread to exit. """
+        if not self.running:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+class SyncStaticAgentConnection:
+    """ Thread-safe, synchronous interface to a StaticAgentConnection.
+
+        The connection lives on one event loop in a background thread, so its
+        pooled session, shared keys and queues stay warm between calls. Sends
+        return concurrent.futures.Future objects; call `.result()` to wait.
+        Route handlers run on the background loop.
+    """
+    def __init__(self, *args, connection: StaticAgentConnection = None, **kwargs):
+        """ Wrap `connection`, or create one from the given arguments. """
+        self.connection = connection or StaticAgentConnection(*args, **kwargs)
+        self._background = BackgroundLoop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    @property
+    def loop(self):
+        return self._background.loop
+
+    def route(self, msg_type):
+        """ Wrap StaticAgentConnection.route """
+        return self.connection.route(msg_type)
+
+    def send(self, msg) -> Future:
+        """ Send a message. """
+        return self._background.submit(self.connection.send(msg))
+
+    def send_many(self, msgs) -> Future:
+        """ Send many messages. """
+        return self._background.submit(self.connection.send_many(list(msgs)))
+
+    def send_and_await(self, msg, timeout: float = 30.0) -> Future:
+        """ Send a message; the future resolves to the reply. """
+        return self._background.submit(self.connection.send_and_await(msg, timeout))
+
+    def handle(self, packed_message) -> Future:
+        """ Unpack and handle a message. """
+        return self._background.submit(self.connection.handle(packed_message))
+
+    def flush(self) -> Future:
+        """ Wait for queued outbound messages to be delivered. """
+        return self._background.submit(self.connection.flush())
+
+    def drain_outbox(self) -> Future:
+        """ Deliver messages waiting in the outbox. """
+        return self._background.submit(self.connection.drain_outbox())
+
+    def close(self):
+        """ Close the connection and stop the background loop. """
+        if not self._background.running:
+            return
+        self._background.submit(self.connection.close()).result()
+        self._background.stop()
@@ -1,4 +1,29 @@
 import datetime
+import json
+
+try:
+    import orjson
+except ImportError: # pragma: no cover
+    orjson = None
 
 def timestamp():
     return datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat(' ')
+
+def json_loads(data):
+    """ Parse JSON from str or bytes, using orjson when it is installed. """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(data) -> bytes:
+    """ Serialize to compact UTF-8 JSON bytes, using orjson when it is installed.
+
+        orjson rejects some data the json module accepts, such as non-str
+        keys and integers beyond 64 bits; such data falls back to json.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
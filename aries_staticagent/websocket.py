@@ -0,0 +1,116 @@
+""" WebSocket transport """
+import asyncio
+import logging
+
+import aiohttp
+
+def is_websocket_endpoint(endpoint: str) -> bool:
+    """ Return whether an endpoint should be reached over WebSocket. """
+    return endpoint.startswith(('ws://', 'wss://'))
+
+class WebSocketTransport:
+    """ Persistent WebSocket to an endpoint, shared by sends and receives.
+
+        The socket is opened on first send. Frames received on it are passed
+        to `on_message` (a coroutine taking the packed message bytes). If the
+        socket drops, it is reopened with exponential backoff between
+        `reconnect_delay` and `max_reconnect_delay` seconds until `close()` is
+        called.
+    """
+    def __init__(
+            self,
+            endpoint: str,
+            session_factory,
+            on_message,
+            *,
+            heartbeat: float = 30.0,
+            reconnect_delay: float = 0.5,
+            max_reconnect_delay: float = 30.0):
+        self.endpoint = endpoint
+        self.session_factory = session_factory
+        self.on_message = on_message
+        self.heartbeat = heartbeat
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.logger = logging.getLogger(__name__)
+
+        self._ws = None
+        self._lock = None
+        self._receiver = None
+        self._handlers = set()
+        self._closing = False
+
+    @property
+    def connected(self):
+        return self._ws is not None and not self._ws.closed
+
+    async def connect(self):
+        """ Open the socket if it is not already open. """
+        if self.connected:
+            return self._ws
+        self._closing = False
+        await self._open()
+        if self._receiver is None or self._receiver.done():
+            self._receiver = asyncio.ensure_future(self._receive_loop())
+        return self._ws
+
+    async def _open(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.connected:
+                self._ws = await self.session_factory().ws_connect(
+                    self.endpoint, heartbeat=self.heartbeat
+                )
+
+    async def send(self, packed_message: bytes):
+        """ Send a packed message, opening the socket if needed. """
+        ws = await self.connect()
+        await ws.send_bytes(packed_message)
+
+    async def close(self):
+        """ Close the socket and stop reconnecting. """
+        self._closing = True
+        if self._receiver is not None:
+            self._receiver.cancel()
+            await asyncio.gather(self._receiver, return_exceptions=True)
+            self._receiver = None
+        if self._ws is not None:
+            await self._ws.close()
+            self._ws = None
+        if self._handlers:
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def _receive_loop(self):
+        while not self._closing:
+            ws = self._ws
+            async for frame in ws:
+                if frame.type == aiohttp.WSMsgType.BINARY:
+                    self._dispatch(frame.data)
+                elif frame.type == aiohttp.WSMsgType.TEXT:
+                    self._dispatch(frame.data.encode('utf-8'))
+                elif frame.type == aiohttp.WSMsgType.ERROR:
+                    self.logger.warning('WebSocket error: %s', ws.exception())
+                    break
+
+            delay = self.reconnect_delay
+            while not self._closing:
+                self.logger.debug('WebSocket to %s dropped; reconnecting', self.endpoint)
+                await asyncio.sleep(delay)
+                try:
+                    await self._open()
+                    break
+                except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as err:
+                    self.logger.debug('WebSocket reconnect failed: %s', err)
+                    delay = min(self.max_reconnect_delay, delay * 2)
+
+    def _dispatch(self, packed_message):
+        task = asyncio.ensure_future(self._handle(packed_message))
+        self._handlers.add(task)
+        task.add_done_callback(self._handlers.discard)
+
+    async def _handle(self, packed_message):
+        try:
+            await self.on_message(packed_message)
+        except Exception: # pylint: disable=broad-except
+            self.logger.exception('Failed to handle message received over WebSocket')
@@ -0,0 +1,58 @@
+""" Benchmark the cost of each added recipient when packing a message.
+
+    Usage: python benchmarks/bench_recipients.py [--workers N]
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import timeit
+
+from aries_staticagent import crypto
+
+RECIPIENT_COUNTS = [1, 10, 50, 100, 250, 500]
+
+def bench_recipients(executor=None, anoncrypt=False, shared_keys=False, repeat=5):
+    """ Return (recipient count, seconds per pack) for each recipient count. """
+    sender_vk, sender_sk = (None, None) if anoncrypt else crypto.create_keypair()
+    recipients = [crypto.create_keypair()[0] for _ in range(max(RECIPIENT_COUNTS))]
+    message = '{"@type": "test_protocol/1.0/announcement", "content": "hello"}'
+
+    results = []
+    for count in RECIPIENT_COUNTS:
+        to_verkeys = recipients[:count]
+        keys = {} if shared_keys else None
+        crypto.pack_message(message, to_verkeys, sender_vk, sender_sk, keys, executor)
+        elapsed = min(timeit.repeat(
+            lambda: crypto.pack_message(
+                message, to_verkeys, sender_vk, sender_sk, keys, executor
+            ),
+            number=1,
+            repeat=repeat
+        ))
+        results.append((count, elapsed))
+    return results
+
+def report(label, results):
+    """ Print per-pack and per-recipient cost. """
+    print(label)
+    print('  {:>10} {:>12} {:>16}'.format('recipients', 'ms/pack', 'us/recipient'))
+    for count, elapsed in results:
+        print('  {:>10} {:>12.3f} {:>16.1f}'.format(
+            count, elapsed * 1e3, elapsed / count * 1e6
+        ))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    report('Anoncrypt', bench_recipients(anoncrypt=True))
+    report('Authcrypt', bench_recipients())
+    report('Authcrypt, shared keys', bench_recipients(shared_keys=True))
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        report(
+            'Authcrypt, {} threads'.format(args.workers),
+            bench_recipients(executor=executor)
+        )
+
+if __name__ == '__main__':
+    main()
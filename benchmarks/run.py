@@ -0,0 +1,250 @@
+""" Benchmark suite for the crypto, message and routing hot paths.
+
+    Usage:
+        python benchmarks/run.py [--output results.json] [--compare baseline.json]
+
+    Results are written as JSON, one entry per benchmark with the best time
+    per operation in microseconds, so runs from different commits can be
+    compared with --compare. Sends go to a stub HTTP server on localhost; no
+    network access is needed.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+import timeit
+
+from aiohttp import web
+
+from aries_staticagent import StaticAgentConnection, crypto
+from aries_staticagent.agent import Agent
+from aries_staticagent.messages import Message
+from aries_staticagent.module import Semver, module
+
+PAYLOAD_SIZES = [100, 1000, 10000, 100000]
+RECIPIENT_COUNTS = [1, 5, 25]
+MSG_TYPE = 'did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/basicmessage/1.0/message'
+
+
+def measure(func, number, repeat=5):
+    """ Return the best time per call of func, in microseconds. """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def measure_async(loop, coro_func, number, repeat=5):
+    """ Return the best time per await of coro_func(), in microseconds. """
+    async def run():
+        start = time.perf_counter()
+        for _ in range(number):
+            await coro_func()
+        return time.perf_counter() - start
+
+    return min(loop.run_until_complete(run()) for _ in range(repeat)) / number * 1e6
+
+
+def payload(size):
+    """ Serialized message of roughly size bytes. """
+    return Message({'@type': MSG_TYPE, 'content': 'x' * size}).serialize(as_bytes=True)
+
+
+def bench_crypto(results):
+    sender_vk, sender_sk = crypto.create_keypair()
+    recipients = [crypto.create_keypair() for _ in range(max(RECIPIENT_COUNTS))]
+    recip_vk, recip_sk = recipients[0]
+
+    for size in PAYLOAD_SIZES:
+        message = payload(size)
+        number = max(10, 20000 // (size // 100 + 10))
+        packed = crypto.pack_message(message, [recip_vk], sender_vk, sender_sk)
+        results['crypto.pack_message[authcrypt,size={}]'.format(size)] = measure(
+            lambda: crypto.pack_message(message, [recip_vk], sender_vk, sender_sk),
+            number
+        )
+        results['crypto.unpack_message[authcrypt,size={}]'.format(size)] = measure(
+            lambda: crypto.unpack_message(packed, recip_vk, recip_sk),
+            number
+        )
+        results['crypto.pack_message[anoncrypt,size={}]'.format(size)] = measure(
+            lambda: crypto.pack_message(message, [recip_vk]),
+            number
+        )
+        results['crypto.pack_message[deflate,size={}]'.format(size)] = measure(
+            lambda: crypto.pack_message(
+                message, [recip_vk], sender_vk, sender_sk, compression=crypto.DEFLATE
+            ),
+            number
+        )
+
+    message = payload(100)
+    for count in RECIPIENT_COUNTS:
+        to_verkeys = [vk for vk, _ in recipients[:count]]
+        packed = crypto.pack_message(message, to_verkeys, sender_vk, sender_sk)
+        last_vk, last_sk = recipients[count - 1]
+        results['crypto.pack_message[recipients={}]'.format(count)] = measure(
+            lambda: crypto.pack_message(message, to_verkeys, sender_vk, sender_sk),
+            200
+        )
+        results['crypto.unpack_message[recipients={}]'.format(count)] = measure(
+            lambda: crypto.unpack_message(packed, last_vk, last_sk),
+            200
+        )
+
+
+def bench_messages(results):
+    content = {'@type': MSG_TYPE, '~l10n': {'locale': 'en'}, 'content': 'hello'}
+    serialized = Message(content).serialize()
+    msg = Message(content)
+
+    results['Message.__init__'] = measure(lambda: Message(content), 10000)
+    results['Message.deserialize'] = measure(lambda: Message.deserialize(serialized), 10000)
+    results['Message.serialize'] = measure(msg.serialize, 10000)
+    results['Message.serialize[bytes]'] = measure(lambda: msg.serialize(as_bytes=True), 10000)
+    results['Semver.from_str[short]'] = measure(lambda: Semver.from_str('1.0'), 10000)
+    results['Semver.from_str[full]'] = measure(lambda: Semver.from_str('1.0.0-rc.1'), 10000)
+
+
+def bench_routing(results, loop):
+    agent = Agent()
+
+    @agent.route(MSG_TYPE)
+    async def direct(agent, msg):
+        pass
+
+    @module
+    class TestModule:
+        DOC_URI = 'did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/'
+        PROTOCOL = 'test_protocol'
+        VERSION = '1.3'
+
+        async def testing_type(self, agent, msg):
+            pass
+
+    agent.route_module(TestModule())
+    direct_msg = Message({'@type': MSG_TYPE})
+    module_msg = Message({
+        '@type': 'did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/test_protocol/1.0/testing_type'
+    })
+
+    results['Agent.handle[direct]'] = measure_async(
+        loop, lambda: agent.handle(direct_msg), 10000
+    )
+    results['Agent.handle[module]'] = measure_async(
+        loop, lambda: agent.handle(module_msg), 10000
+    )
+
+
+def bench_connection(results, loop):
+    async def accept(request):
+        await request.read()
+        raise web.HTTPAccepted()
+
+    app = web.Application()
+    app.add_routes([web.post('/', accept)])
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+
+    my_vk, my_sk = crypto.create_keypair()
+    their_vk, their_sk = crypto.create_keypair()
+    conn = StaticAgentConnection(
+        'http://127.0.0.1:{}/'.format(port),
+        crypto.bytes_to_b58(their_vk),
+        crypto.bytes_to_b58(my_vk),
+        crypto.bytes_to_b58(my_sk)
+    )
+
+    @conn.route(MSG_TYPE)
+    async def basic_message(agent, msg):
+        pass
+
+    inbound = crypto.pack_message(payload(100), [my_vk], their_vk, their_sk)
+    msg = {'@type': MSG_TYPE, 'content': 'hello'}
+
+    try:
+        results['StaticAgentConnection.handle'] = measure_async(
+            loop, lambda: conn.handle(inbound), 1000
+        )
+        results['StaticAgentConnection.send'] = measure_async(
+            loop, lambda: conn.send(msg), 200
+        )
+        results['StaticAgentConnection.send_many[100]'] = measure_async(
+            loop, lambda: conn.send_many([msg] * 100), 5
+        ) / 100
+    finally:
+        loop.run_until_complete(conn.close())
+        loop.run_until_complete(runner.cleanup())
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """ Print the change of each benchmark relative to a baseline run. """
+    print('{:<50} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline us', 'current us', 'change'))
+    for name, value in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print('{:<50} {:>12} {:>12.2f} {:>8}'.format(name, '-', value, 'new'))
+            continue
+        print('{:<50} {:>12.2f} {:>12.2f} {:>+7.1f}%'.format(
+            name, previous, value, (value - previous) / previous * 100
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--compare', help='Compare against JSON results from a previous run')
+    parser.add_argument(
+        '--only', action='append', choices=['crypto', 'messages', 'routing', 'connection'],
+        help='Run only the named group; may be repeated'
+    )
+    args = parser.parse_args()
+    groups = args.only or ['crypto', 'messages', 'routing', 'connection']
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = {}
+    if 'crypto' in groups:
+        bench_crypto(results)
+    if 'messages' in groups:
+        bench_messages(results)
+    if 'routing' in groups:
+        bench_routing(results, loop)
+    if 'connection' in groups:
+        bench_connection(results, loop)
+    loop.close()
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'unit': 'us/op',
+        'results': results,
+    }
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file)['results'])
+    else:
+        for name, value in results.items():
+            print('{:<50} {:>12.2f} us'.format(name, value))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
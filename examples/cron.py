@@ -2,7 +2,7 @@
 import argparse
 import os
 
-from aries_staticagent import StaticAgentConnection, utils
+from aries_staticagent import StaticAgentConnection, Outbox, utils
 
 # Config Start
 
@@ -22,13 +22,17 @@ parser.add_argument('--endpoint', **environ_or_required('ARIES_ENDPOINT'))
 parser.add_argument('--endpointkey', **environ_or_required('ARIES_ENDPOINT_KEY'))
 parser.add_argument('--mypublickey', **environ_or_required('ARIES_MY_PUBLIC_KEY'))
 parser.add_argument('--myprivatekey', **environ_or_required('ARIES_MY_PRIVATE_KEY'))
+parser.add_argument('--outbox', default=os.environ.get('ARIES_OUTBOX', 'outbox.db'))
 args = parser.parse_args()
 
 # Config End
 
-a = StaticAgentConnection(args.endpoint, args.endpointkey, args.mypublickey, args.myprivatekey)
+# Messages that cannot be delivered now stay in the outbox and are sent on the next run.
+a = StaticAgentConnection(
+    args.endpoint, args.endpointkey, args.mypublickey, args.myprivatekey,
+    outbox=Outbox(args.outbox)
+)
 
-# TODO: the send() method will apply an id if not present
 a.send_blocking({
         "@type": "did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/basicmessage/1.0/message",
         "~l10n": {"locale": "en"},
@@ -36,3 +40,4 @@ a.send_blocking({
         "content": "The Cron Script has ben executed."
 })
 
+a.close_blocking()
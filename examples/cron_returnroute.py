@@ -3,6 +3,7 @@
 # return routes.
 
 import argparse
+import asyncio
 import os
 
 from aries_staticagent import StaticAgentConnection, utils
@@ -31,13 +32,14 @@ args = parser.parse_args()
 
 a = StaticAgentConnection(args.endpoint, args.endpointkey, args.mypublickey, args.myprivatekey)
 
-#TODO a.returnroute = "thread"
-
-@a.route("did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/trust_ping/1.0/ping_response")
-async def ping_response(msg):
-    print("Ping Response Returned")
-
-a.send_blocking({
-    "@type": "did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/trust_ping/1.0/ping",
-    "response_requested": True
-})
+async def main():
+    async with a:
+        # The ping asks for replies in its thread to come back on the same
+        # connection; no inbound listener is needed
+        await a.send_and_await({
+            "@type": "did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/trust_ping/1.0/ping",
+            "response_requested": True
+        }, timeout=30)
+        print("Ping Response Returned")
+
+asyncio.get_event_loop().run_until_complete(main())
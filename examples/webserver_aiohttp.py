@@ -1,8 +1,9 @@
 # This file is intended to be run as a cron script. Upon execution, it does it's thing and shuts down.
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import os
 
-from aries_staticagent import StaticAgentConnection, utils
+from aries_staticagent import StaticAgentConnection, PipelineFullException, utils
 
 from aiohttp import web
 
@@ -29,8 +30,13 @@ args = parser.parse_args()
 
 # Config End
 
-a = StaticAgentConnection(args.endpoint, args.endpointkey, args.mypublickey, args.myprivatekey)
-#a.returnroute = "thread"
+# Pack and unpack off the event loop so large messages don't stall other requests
+a = StaticAgentConnection(
+    args.endpoint, args.endpointkey, args.mypublickey, args.myprivatekey,
+    executor=ThreadPoolExecutor(),
+    inline_threshold=4096
+)
+#a.return_route = "thread"
 
 @a.route("did:sov:BzCbsNYhMrjHiqZDTUASHg;spec/basicmessage/1.0/message")
 async def basic_message(agent, msg):
@@ -43,7 +49,11 @@ async def basic_message(agent, msg):
 
 
 async def handle(request):
-    await a.handle(await request.read())
+    # Acknowledge right away; workers unpack and handle the message
+    try:
+        a.enqueue(await request.read())
+    except PipelineFullException:
+        raise web.HTTPServiceUnavailable(headers={'Retry-After': '1'})
     raise web.HTTPAccepted()
 
 app = web.Application()
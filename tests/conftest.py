@@ -0,0 +1,26 @@
+""" Shared test fixtures """
+from aiohttp import web
+import pytest_asyncio
+
+@pytest_asyncio.fixture
+async def serve():
+    """ Run local stub endpoints; `await serve(handler)` returns the URL.
+
+        Pass `websocket=True` to serve `handler` for WebSocket upgrades.
+    """
+    runners = []
+
+    async def _serve(handler, websocket=False):
+        app = web.Application()
+        app.add_routes([web.get('/', handler) if websocket else web.post('/', handler)])
+        runner = web.AppRunner(app)
+        await runner.setup()
+        runners.append(runner)
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return '{}://127.0.0.1:{}/'.format('ws' if websocket else 'http', port)
+
+    yield _serve
+    for runner in runners:
+        await runner.cleanup()
@@ -165,3 +165,136 @@ async def test_module_routing_minor_version_different():
     await agent.handle(test_msg, event=called_event)
 
     assert called_event.is_set()
+
+@pytest.mark.asyncio
+async def test_dispatch_cache_invalidated():
+    """ Test that registering routes invalidates resolved handlers. """
+    agent = Agent()
+    agent.called_module = None
+
+    @module
+    class TestModule1():
+        DOC_URI = ''
+        PROTOCOL = 'test_protocol'
+        VERSION = '1.0'
+
+        async def testing_type(self, agent, msg, *args, **kwargs):
+            agent.called_module = 1
+
+    @module
+    class TestModule2():
+        DOC_URI = ''
+        PROTOCOL = 'test_protocol'
+        VERSION = '1.1'
+
+        async def testing_type(self, agent, msg, *args, **kwargs):
+            agent.called_module = 2
+
+    test_msg = Message({'@type': 'test_protocol/1.0/testing_type', 'test': 'test'})
+
+    agent.route_module(TestModule1())
+    await agent.handle(test_msg)
+    assert agent.called_module == 1
+    assert 'test_protocol/1.0/testing_type' in agent._dispatch
+
+    agent.route_module(TestModule2())
+    await agent.handle(test_msg)
+    assert agent.called_module == 2
+
+    @agent.route('test_protocol/1.0/testing_type')
+    async def direct(agent, msg, **kwargs):
+        agent.called_module = 'direct'
+
+    await agent.handle(test_msg)
+    assert agent.called_module == 'direct'
+
+@pytest.mark.asyncio
+async def test_dispatch_cache_full():
+    """ Test that a full dispatch cache still caches newly routed types. """
+    agent = Agent()
+    agent.DISPATCH_CACHE_SIZE = 4
+    handled = []
+
+    @agent.route('test_protocol/1.0/testing_type')
+    async def testing_type(agent, msg, **kwargs):
+        handled.append(msg)
+
+    for i in range(10):
+        with pytest.raises(NoRegisteredRouteException):
+            await agent.handle(Message({'@type': 'test_protocol/1.0/unknown_{}'.format(i)}))
+    assert not agent._dispatch
+
+    for i in range(5):
+        @agent.route('test_protocol/1.0/routed_{}'.format(i))
+        async def routed(agent, msg, **kwargs):
+            pass
+    for i in range(5):
+        await agent.handle(Message({'@type': 'test_protocol/1.0/routed_{}'.format(i)}))
+    await agent.handle(Message({'@type': 'test_protocol/1.0/testing_type'}))
+
+    assert len(agent._dispatch) == 4
+    assert 'test_protocol/1.0/testing_type' in agent._dispatch
+    assert 'test_protocol/1.0/routed_0' not in agent._dispatch
+    assert len(handled) == 1
+
+@pytest.mark.asyncio
+async def test_additional_routes_sequential():
+    """ Test that additional handlers run after the routed handler. """
+    agent = Agent()
+    calls = []
+
+    @agent.route('testing_type')
+    async def primary(agent, msg):
+        calls.append('primary')
+
+    @agent.add_route('testing_type')
+    async def audit(agent, msg):
+        calls.append('audit')
+
+    await agent.handle(MockMessage('testing_type', 'test'))
+    assert calls == ['primary', 'audit']
+
+@pytest.mark.asyncio
+async def test_additional_routes_concurrent():
+    """ Test concurrent dispatch with timeouts, error isolation and background handlers. """
+    agent = Agent(dispatch='concurrent', handler_timeout=0.05)
+    calls = []
+
+    @agent.route('testing_type')
+    async def primary(agent, msg):
+        calls.append('primary')
+
+    @agent.add_route('testing_type')
+    async def failing(agent, msg):
+        raise ValueError('failed')
+
+    @agent.add_route('testing_type')
+    async def slow(agent, msg):
+        await asyncio.sleep(1)
+        calls.append('slow')
+
+    @agent.add_route('testing_type', background=True)
+    async def persist(agent, msg):
+        await asyncio.sleep(0.01)
+        calls.append('persist')
+
+    with pytest.raises(ValueError):
+        await agent.handle(MockMessage('testing_type', 'test'))
+    assert 'slow' not in calls
+
+    await agent.join_background()
+    assert calls == ['primary', 'persist']
+
+@pytest.mark.asyncio
+async def test_additional_route_only():
+    """ Test that an additional handler alone makes a type routable. """
+    agent = Agent()
+    called_event = asyncio.Event()
+
+    @agent.add_route('test_protocol/1.0/testing_type')
+    async def audit(agent, msg, **kwargs):
+        kwargs['event'].set()
+
+    test_msg = Message({'@type': 'test_protocol/1.0/testing_type'})
+    await agent.handle(test_msg, event=called_event)
+    assert called_event.is_set()
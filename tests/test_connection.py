@@ -0,0 +1,431 @@
+""" Test StaticAgentConnection """
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+
+from aiohttp import web
+import pytest
+import pytest_asyncio
+
+from aries_staticagent import (
+    StaticAgentConnection, Outbox, PipelineFullException, ReplayCache, crypto
+)
+
+@pytest.fixture
+def keys():
+    """ Generate keys for both sides of a static connection. """
+    my_vk, my_sk = crypto.create_keypair()
+    their_vk, their_sk = crypto.create_keypair()
+    return my_vk, my_sk, their_vk, their_sk
+
+@pytest_asyncio.fixture
+async def endpoint(serve):
+    """ Run a local stub endpoint collecting posted messages. """
+    received = []
+
+    async def handle(request):
+        received.append(await request.read())
+        raise web.HTTPAccepted()
+
+    return await serve(handle), received
+
+def connection_for(url, keys, **kwargs):
+    """ Create a connection from our keys to their keys. """
+    my_vk, my_sk, their_vk, _ = keys
+    return StaticAgentConnection(
+        url,
+        crypto.bytes_to_b58(their_vk),
+        crypto.bytes_to_b58(my_vk),
+        crypto.bytes_to_b58(my_sk),
+        **kwargs
+    )
+
+@pytest.mark.asyncio
+async def test_send_reuses_session(endpoint, keys):
+    """ Test that sends share one pooled session until closed. """
+    url, received = endpoint
+    async with connection_for(url, keys, pool_limit_per_host=2) as conn:
+        await conn.send({'@type': 'test_protocol/1.0/testing_type'})
+        session = conn.session
+        await conn.send({'@type': 'test_protocol/1.0/testing_type'})
+        assert conn.session is session
+
+    assert session.closed
+    assert len(received) == 2
+
+    _, _, their_vk, their_sk = keys
+    msg, sender_vk, _ = crypto.unpack_message(received[0], their_vk, their_sk)
+    assert 'test_protocol/1.0/testing_type' in msg
+    assert sender_vk == crypto.bytes_to_b58(keys[0])
+
+@pytest.mark.asyncio
+async def test_send_many(endpoint, keys):
+    """ Test that send_many delivers every message. """
+    url, received = endpoint
+    async with connection_for(url, keys) as conn:
+        await conn.send_many([
+            {'@type': 'test_protocol/1.0/testing_type', 'n': n} for n in range(5)
+        ])
+
+    _, _, their_vk, their_sk = keys
+    numbers = sorted(
+        json.loads(crypto.unpack_message(packed, their_vk, their_sk)[0])['n']
+        for packed in received
+    )
+    assert numbers == list(range(5))
+
+@pytest.mark.asyncio
+async def test_executor_offload(endpoint, keys):
+    """ Test that packing and unpacking work on an executor. """
+    url, received = endpoint
+    my_vk, _, their_vk, their_sk = keys
+    handled = []
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        async with connection_for(url, keys, executor=executor) as conn:
+            @conn.route('test_protocol/1.0/testing_type')
+            async def testing_type(agent, msg):
+                handled.append(msg)
+
+            await conn.send({'@type': 'test_protocol/1.0/testing_type'})
+            await conn.handle(crypto.pack_message(
+                json.dumps({'@type': 'test_protocol/1.0/testing_type'}),
+                [my_vk], their_vk, their_sk
+            ))
+
+    assert len(received) == 1
+    assert len(handled) == 1
+
+@pytest.mark.asyncio
+async def test_inbound_pipeline_backpressure(keys):
+    """ Test that the inbound pipeline handles messages and pushes back when full. """
+    my_vk, _, their_vk, their_sk = keys
+    release = asyncio.Event()
+    handled = []
+
+    conn = connection_for('http://127.0.0.1:1/', keys, inbound_workers=1, inbound_queue_size=2)
+
+    @conn.route('test_protocol/1.0/testing_type')
+    async def testing_type(agent, msg):
+        await release.wait()
+        handled.append(msg)
+
+    packed = crypto.pack_message(
+        json.dumps({'@type': 'test_protocol/1.0/testing_type'}),
+        [my_vk], their_vk, their_sk
+    )
+    conn.enqueue(packed)
+    conn.enqueue(packed)
+    with pytest.raises(PipelineFullException):
+        conn.enqueue(packed)
+
+    release.set()
+    await conn.inbound.join()
+    assert len(handled) == 2
+
+    await conn.close()
+    assert not conn.inbound.running
+
+@pytest.mark.asyncio
+async def test_replayed_message_dropped(keys):
+    """ Test that a redelivered message is handled once with a replay cache. """
+    my_vk, _, their_vk, their_sk = keys
+    handled = []
+
+    conn = connection_for('http://127.0.0.1:1/', keys, replay_cache=ReplayCache())
+
+    @conn.route('test_protocol/1.0/testing_type')
+    async def testing_type(agent, msg):
+        handled.append(msg)
+
+    packed = crypto.pack_message(
+        json.dumps({'@type': 'test_protocol/1.0/testing_type', '@id': '1'}),
+        [my_vk], their_vk, their_sk
+    )
+    await conn.handle(packed)
+    await conn.handle(packed)
+    assert len(handled) == 1
+
+@pytest.mark.asyncio
+async def test_failed_message_handled_on_retry(keys):
+    """ Test that a message whose handler raised is handled when redelivered. """
+    my_vk, _, their_vk, their_sk = keys
+    handled = []
+
+    conn = connection_for('http://127.0.0.1:1/', keys, replay_cache=ReplayCache())
+
+    @conn.route('test_protocol/1.0/testing_type')
+    async def testing_type(agent, msg):
+        handled.append(msg)
+        if len(handled) == 1:
+            raise RuntimeError('transient')
+
+    packed = crypto.pack_message(
+        json.dumps({'@type': 'test_protocol/1.0/testing_type', '@id': '1'}),
+        [my_vk], their_vk, their_sk
+    )
+    with pytest.raises(RuntimeError):
+        await conn.handle(packed)
+    await conn.handle(packed)
+    await conn.handle(packed)
+    assert len(handled) == 2
+
+@pytest.mark.asyncio
+async def test_handle_utf8(keys):
+    """ Test that UTF-8 content reaches handlers, with the raw bytes if kept. """
+    my_vk, _, their_vk, their_sk = keys
+    handled = []
+
+    conn = connection_for('http://127.0.0.1:1/', keys, keep_raw=True)
+
+    @conn.route('test_protocol/1.0/testing_type')
+    async def testing_type(agent, msg):
+        handled.append(msg)
+
+    serialized = json.dumps(
+        {'@type': 'test_protocol/1.0/testing_type', 'content': 'Grüße'}, ensure_ascii=False
+    ).encode('utf-8')
+    await conn.handle(crypto.pack_message(serialized, [my_vk], their_vk, their_sk))
+    assert handled[0]['content'] == 'Grüße'
+    assert handled[0].raw == serialized
+
+@pytest.mark.asyncio
+async def test_handle_stream(keys):
+    """ Test that a message read from a stream in chunks is handled. """
+    my_vk, _, their_vk, their_sk = keys
+    handled = []
+
+    conn = connection_for('http://127.0.0.1:1/', keys)
+
+    @conn.route('test_protocol/1.0/testing_type')
+    async def testing_type(agent, msg):
+        handled.append(msg)
+
+    stream = asyncio.StreamReader()
+    stream.feed_data(crypto.pack_message(
+        json.dumps({'@type': 'test_protocol/1.0/testing_type', 'content': 'x' * 5000}),
+        [my_vk], their_vk, their_sk
+    ))
+    stream.feed_eof()
+    await conn.handle_stream(stream, chunk_size=100)
+    assert handled[0]['content'] == 'x' * 5000
+
+@pytest.mark.asyncio
+async def test_outbox_delivers_after_failure(serve, keys, tmp_path):
+    """ Test that messages stay in the outbox until the endpoint takes them. """
+    received = []
+    available = False
+
+    async def handle(request):
+        if not available:
+            raise web.HTTPServiceUnavailable()
+        received.append(await request.read())
+        raise web.HTTPAccepted()
+
+    url = await serve(handle)
+
+    outbox = Outbox(str(tmp_path / 'outbox.db'))
+    try:
+        async with connection_for(url, keys, outbox=outbox) as conn:
+            conn.outbound.backoff = 0.01
+            await conn.send({'@type': 'test_protocol/1.0/testing_type'})
+            await conn.send_many([{'@type': 'test_protocol/1.0/testing_type'}] * 2)
+            assert len(outbox) == 3
+            await asyncio.sleep(0.05)
+            assert not received
+
+            available = True
+            for _ in range(100):
+                if not outbox:
+                    break
+                await asyncio.sleep(0.01)
+            assert len(received) == 3
+            assert not outbox
+    finally:
+        outbox.close()
+
+@pytest.mark.asyncio
+async def test_outbox_compacted_after_drain(endpoint, keys, tmp_path):
+    """ Test that draining the outbox releases the space of sent messages. """
+    url, received = endpoint
+    outbox = Outbox(str(tmp_path / 'outbox.db'), compact_pages=1)
+
+    def free_pages():
+        return outbox._db.execute('PRAGMA freelist_count').fetchone()[0]
+
+    try:
+        async with connection_for(url, keys, outbox=outbox) as conn:
+            await conn.send_many(
+                [{'@type': 'test_protocol/1.0/testing_type', 'content': 'x' * 5000}] * 20
+            )
+            for _ in range(100):
+                if not outbox and not free_pages():
+                    break
+                await asyncio.sleep(0.01)
+            assert len(received) == 20
+            assert not outbox
+            assert not free_pages()
+    finally:
+        outbox.close()
+
+@pytest.mark.asyncio
+async def test_outbox_reply_failure_not_resent(serve, keys, tmp_path):
+    """ Test that a failing reply handler leaves no outbox entry behind. """
+    my_vk, _, their_vk, their_sk = keys
+    attempts = []
+
+    async def handle(request):
+        attempts.append(await request.read())
+        return web.Response(status=200, body=crypto.pack_message(
+            json.dumps({'@type': 'test_protocol/1.0/reply'}), [my_vk], their_vk, their_sk
+        ))
+
+    url = await serve(handle)
+    outbox = Outbox(str(tmp_path / 'outbox.db'))
+    try:
+        conn = connection_for(url, keys, outbox=outbox)
+
+        @conn.route('test_protocol/1.0/reply')
+        async def reply(agent, msg):
+            raise ConnectionError('handler failed')
+
+        await conn.send({'@type': 'test_protocol/1.0/testing_type'})
+        await conn.close()
+        await conn.drain_outbox()
+        assert len(attempts) == 1
+        assert not outbox
+    finally:
+        outbox.close()
+
+@pytest.mark.asyncio
+async def test_queued_send_retries(serve, keys):
+    """ Test that queued sends are retried on 5xx responses. """
+    received = []
+    attempts = []
+
+    async def handle(request):
+        attempts.append(await request.read())
+        if len(attempts) % 2:
+            raise web.HTTPServiceUnavailable()
+        received.append(attempts[-1])
+        raise web.HTTPAccepted()
+
+    url = await serve(handle)
+
+    conn = connection_for(
+        url, keys, queue_outbound=True, outbound_concurrency=1
+    )
+    conn.outbound.backoff = 0.01
+    try:
+        await conn.send({'@type': 'test_protocol/1.0/testing_type'})
+        await conn.send_many([{'@type': 'test_protocol/1.0/testing_type'}] * 2)
+        await conn.flush()
+    finally:
+        await conn.close()
+
+    assert len(received) == 3
+    assert len(attempts) == 6
+
+@pytest.mark.asyncio
+async def test_queued_reply_failure_not_resent(serve, keys):
+    """ Test that a failing reply handler does not cause an accepted message to be resent. """
+    my_vk, _, their_vk, their_sk = keys
+    attempts = []
+
+    async def handle(request):
+        attempts.append(await request.read())
+        return web.Response(status=200, body=crypto.pack_message(
+            json.dumps({'@type': 'test_protocol/1.0/reply'}), [my_vk], their_vk, their_sk
+        ))
+
+    url = await serve(handle)
+    errors = []
+    conn = connection_for(url, keys, queue_outbound=True, handler_timeout=0.01)
+    conn.outbound.backoff = 0.01
+    conn.outbound.on_error = lambda packed_msg, err: errors.append(err)
+
+    @conn.route('test_protocol/1.0/reply')
+    async def reply(agent, msg):
+        raise ConnectionError('handler failed')
+
+    try:
+        await conn.send({'@type': 'test_protocol/1.0/testing_type'})
+        await conn.flush()
+    finally:
+        await conn.close()
+
+    assert len(attempts) == 1
+    assert not errors
+
+@pytest.mark.asyncio
+async def test_websocket_transport(serve, keys):
+    """ Test sending and receiving over a WebSocket that drops after each message. """
+    my_vk, _, their_vk, their_sk = keys
+    received = []
+
+    async def handle(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        frame = await ws.receive()
+        msg, _, _ = crypto.unpack_message(frame.data, their_vk, their_sk)
+        received.append(json.loads(msg))
+        await ws.send_bytes(crypto.pack_message(
+            json.dumps({'@type': 'test_protocol/1.0/reply', 'n': received[-1]['n']}),
+            [my_vk], their_vk, their_sk
+        ))
+        await ws.close()
+        return ws
+
+    url = await serve(handle, websocket=True)
+
+    replies = asyncio.Queue()
+    conn = connection_for(url, keys)
+    conn._websocket.reconnect_delay = 0.01
+
+    @conn.route('test_protocol/1.0/reply')
+    async def reply(agent, msg):
+        await replies.put(msg['n'])
+
+    try:
+        for n in range(2):
+            await conn.send({'@type': 'test_protocol/1.0/testing_type', 'n': n})
+            assert await asyncio.wait_for(replies.get(), 5) == n
+    finally:
+        await conn.close()
+
+    assert [msg['n'] for msg in received] == [0, 1]
+
+@pytest.mark.asyncio
+async def test_send_and_await(serve, keys):
+    """ Test that replies returned on the HTTP response are correlated. """
+    my_vk, _, their_vk, their_sk = keys
+
+    async def handle(request):
+        msg, _, _ = crypto.unpack_message(await request.read(), their_vk, their_sk)
+        msg = json.loads(msg)
+        assert msg['~transport'] == {'return_route': 'thread'}
+        return web.Response(status=200, body=crypto.pack_message(
+            json.dumps({
+                '@type': 'test_protocol/1.0/ping_response',
+                '~thread': {'thid': msg['@id']}
+            }),
+            [my_vk], their_vk, their_sk
+        ))
+
+    url = await serve(handle)
+
+    routed = []
+    conn = connection_for(url, keys)
+
+    @conn.route('test_protocol/1.0/ping_response')
+    async def ping_response(agent, msg):
+        routed.append(msg)
+
+    try:
+        reply = await conn.send_and_await({'@type': 'test_protocol/1.0/ping'}, timeout=5)
+    finally:
+        await conn.close()
+
+    assert reply.type == 'test_protocol/1.0/ping_response'
+    assert not routed
+    assert not conn._pending_replies
@@ -0,0 +1,282 @@
+""" Test crypto """
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import tracemalloc
+
+import pytest
+
+from aries_staticagent import crypto
+
+@pytest.fixture
+def keys():
+    """ Generate a sender and a recipient keypair. """
+    return crypto.create_keypair(), crypto.create_keypair()
+
+def test_pack_unpack_authcrypt(keys):
+    """ Test that an authcrypted message round trips. """
+    (alice_vk, alice_sk), (bob_vk, bob_sk) = keys
+    packed = crypto.pack_message('{"hello": "world"}', [bob_vk], alice_vk, alice_sk)
+    msg, sender_vk, recip_vk = crypto.unpack_message(packed, bob_vk, bob_sk)
+    assert msg == '{"hello": "world"}'
+    assert sender_vk == crypto.bytes_to_b58(alice_vk)
+    assert recip_vk == crypto.bytes_to_b58(bob_vk)
+
+def test_pack_unpack_anoncrypt(keys):
+    """ Test that an anoncrypted message round trips. """
+    _, (bob_vk, bob_sk) = keys
+    packed = crypto.pack_message('{"hello": "world"}', [bob_vk])
+    msg, sender_vk, _ = crypto.unpack_message(packed, bob_vk, bob_sk)
+    assert msg == '{"hello": "world"}'
+    assert sender_vk is None
+
+def test_pack_unpack_utf8(keys):
+    """ Test that UTF-8 messages round trip as str and as bytes. """
+    (alice_vk, alice_sk), (bob_vk, bob_sk) = keys
+    message = '{"content": "Grüße, 世界"}'
+
+    packed = crypto.pack_message(message, [bob_vk], alice_vk, alice_sk)
+    assert crypto.unpack_message(packed, bob_vk, bob_sk)[0] == message
+
+    packed = crypto.pack_message(message.encode('utf-8'), [bob_vk], alice_vk, alice_sk)
+    msg, _, _ = crypto.unpack_message(packed, bob_vk, bob_sk, as_bytes=True)
+    assert msg == message.encode('utf-8')
+
+    key = crypto.random_seed()
+    ciphertext, nonce, tag = crypto.encrypt_plaintext(message, b'', key)
+    assert len(tag) == 16
+    assert crypto.decrypt_plaintext(ciphertext + tag, b'', nonce, key) == message
+
+def test_key_conversions_cached(keys):
+    """ Test that repeated packs reuse converted keys. """
+    (alice_vk, alice_sk), (bob_vk, bob_sk) = keys
+    crypto.clear_key_cache()
+    for _ in range(3):
+        packed = crypto.pack_message('{}', [bob_vk], alice_vk, alice_sk)
+        crypto.unpack_message(packed, bob_vk, bob_sk)
+
+    assert crypto.verkey_to_box_pk.cache_info().misses == 2
+    assert set(crypto._box_sks) == {alice_vk, bob_vk}
+    assert crypto.verkey_to_box_pk.cache_info().hits > 0
+
+def test_shared_key_cache_bounded(keys):
+    """ Test that shared keys for unknown senders are evicted past maxsize. """
+    (alice_vk, alice_sk), (bob_vk, bob_sk) = keys
+    shared_keys = crypto.SharedKeyCache(maxsize=2)
+    crypto.shared_key(shared_keys, bob_vk, bob_sk, alice_vk)
+    for _ in range(5):
+        sender_vk, sender_sk = crypto.create_keypair()
+        packed = crypto.pack_message('{}', [bob_vk], sender_vk, sender_sk)
+        crypto.unpack_message(packed, bob_vk, bob_sk, shared_keys)
+        crypto.shared_key(shared_keys, bob_vk, bob_sk, alice_vk)
+    assert len(shared_keys) == 2
+    assert (bob_vk, alice_vk) in shared_keys
+
+def test_pack_unpack_shared_keys(keys):
+    """ Test that precomputed shared keys interoperate with crypto_box. """
+    (alice_vk, alice_sk), (bob_vk, bob_sk) = keys
+    alice_shared, bob_shared = {}, {}
+
+    packed = crypto.pack_message('{}', [bob_vk], alice_vk, alice_sk, alice_shared)
+    msg, sender_vk, _ = crypto.unpack_message(packed, bob_vk, bob_sk)
+    assert msg == '{}'
+    assert sender_vk == crypto.bytes_to_b58(alice_vk)
+
+    packed = crypto.pack_message('{}', [alice_vk], bob_vk, bob_sk)
+    msg, sender_vk, _ = crypto.unpack_message(packed, alice_vk, alice_sk, alice_shared)
+    assert msg == '{}'
+
+    packed = crypto.pack_message('{}', [bob_vk], alice_vk, alice_sk, alice_shared)
+    crypto.unpack_message(packed, bob_vk, bob_sk, bob_shared)
+
+    assert list(alice_shared) == [(alice_vk, bob_vk)]
+    assert alice_shared[(alice_vk, bob_vk)] == bob_shared[(bob_vk, alice_vk)]
+
+def test_pack_messages_ordered(keys):
+    """ Test that batch packing preserves message order. """
+    (alice_vk, alice_sk), (bob_vk, bob_sk) = keys
+    messages = ['{{"n": {}}}'.format(i) for i in range(10)]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for packed_msgs in (
+                crypto.pack_messages(messages, [bob_vk], alice_vk, alice_sk),
+                crypto.pack_messages(iter(messages), [bob_vk], executor=executor)):
+            unpacked = [
+                crypto.unpack_message(packed, bob_vk, bob_sk)[0]
+                for packed in packed_msgs
+            ]
+            assert unpacked == messages
+
+def test_pack_many_recipients(keys):
+    """ Test that every recipient of a multi-recipient pack can unpack it. """
+    alice_vk, alice_sk = keys[0]
+    recipients = [crypto.create_keypair() for _ in range(20)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        packed = crypto.pack_message(
+            '{}', [vk for vk, _ in recipients], alice_vk, alice_sk, executor=executor
+        )
+
+    for vk, sk in recipients:
+        msg, sender_vk, recip_vk = crypto.unpack_message(packed, vk, sk)
+        assert msg == '{}'
+        assert sender_vk == crypto.bytes_to_b58(alice_vk)
+        assert recip_vk == crypto.bytes_to_b58(vk)
+
+def test_unpack_with_keyring(keys):
+    """ Test that unpack resolves the matching key from a keyring. """
+    (alice_vk, alice_sk), (bob_vk, bob_sk) = keys
+    others = [crypto.create_keypair() for _ in range(5)]
+    keyring = crypto.create_keyring(others + [(bob_vk, bob_sk)])
+
+    packed = crypto.pack_message(
+        '{}', [vk for vk, _ in others[:3]] + [bob_vk], alice_vk, alice_sk
+    )
+    for vk, _ in others[:3] + [(bob_vk, bob_sk)]:
+        keyring_for = {crypto.bytes_to_b58(vk): keyring[crypto.bytes_to_b58(vk)]}
+        _, _, recip_vk = crypto.unpack_message(packed, keyring=keyring_for)
+        assert recip_vk == crypto.bytes_to_b58(vk)
+
+    _, _, recip_vk = crypto.unpack_message(packed, keyring=keyring)
+    assert recip_vk in keyring
+
+    packed = crypto.pack_message('{}', [alice_vk])
+    with pytest.raises(ValueError):
+        crypto.unpack_message(packed, keyring=keyring)
+
+def test_pack_envelope_format(keys):
+    """ Test that the envelope matches the json.dumps wire format. """
+    (alice_vk, alice_sk), (bob_vk, _) = keys
+    packed = crypto.pack_message('{"hello": "world"}', [bob_vk], alice_vk, alice_sk)
+    envelope = json.loads(packed)
+    assert list(envelope) == ['protected', 'iv', 'ciphertext', 'tag']
+    assert json.dumps(envelope).encode('ascii') == packed
+
+def test_unpack_message_stream(keys):
+    """ Test that a message unpacked from small chunks matches unpack_message. """
+    (alice_vk, alice_sk), (bob_vk, bob_sk) = keys
+    message = json.dumps({'content': 'x' * 10000})
+    packed = crypto.pack_message(message, [bob_vk], alice_vk, alice_sk)
+
+    chunks = [packed[i:i + 7] for i in range(0, len(packed), 7)]
+    msg, sender_vk, _ = crypto.unpack_message_stream(chunks, bob_vk, bob_sk)
+    assert msg.decode('ascii') == message
+    assert sender_vk == crypto.bytes_to_b58(alice_vk)
+
+    tampered = bytearray(packed)
+    index = packed.index(b'"ciphertext": "') + 20
+    tampered[index] = ord('A') if tampered[index] != ord('A') else ord('B')
+    with pytest.raises(ValueError):
+        crypto.unpack_message_stream([bytes(tampered)], bob_vk, bob_sk)
+
+def test_pack_message_chunks(keys):
+    """ Test that chunked packing produces an ordinary envelope. """
+    (alice_vk, alice_sk), (bob_vk, bob_sk) = keys
+    message = json.dumps({'content': 'x' * 10000})
+    chunks = list(crypto.pack_message_chunks(
+        message, [bob_vk], alice_vk, alice_sk, chunk_size=1000
+    ))
+    assert len(chunks) > 10
+    assert crypto.unpack_message(b''.join(chunks), bob_vk, bob_sk)[0] == message
+
+@pytest.mark.parametrize('algorithm', [
+    crypto.DEFLATE,
+    pytest.param(crypto.ZSTD, marks=pytest.mark.skipif(
+        crypto.zstandard is None, reason='zstandard not installed'
+    )),
+])
+def test_pack_compressed(keys, algorithm):
+    """ Test that compressed payloads are signalled and unpacked transparently. """
+    (alice_vk, alice_sk), (bob_vk, bob_sk) = keys
+    message = json.dumps({'content': 'compressible ' * 1000})
+
+    packed = crypto.pack_message(message, [bob_vk], alice_vk, alice_sk, compression=algorithm)
+    assert len(packed) < len(message)
+    protected = json.loads(
+        crypto.b64_to_bytes(json.loads(packed)['protected'], urlsafe=True)
+    )
+    assert protected['zip'] == algorithm
+    assert crypto.unpack_message(packed, bob_vk, bob_sk)[0] == message
+    assert crypto.unpack_message_stream([packed], bob_vk, bob_sk)[0] == message.encode()
+
+    chunks = crypto.pack_message_chunks(message, [bob_vk], compression=algorithm)
+    assert crypto.unpack_message(b''.join(chunks), bob_vk, bob_sk)[0] == message
+
+    small = crypto.pack_message('{}', [bob_vk], compression=algorithm)
+    assert 'zip' not in json.loads(
+        crypto.b64_to_bytes(json.loads(small)['protected'], urlsafe=True)
+    )
+
+def test_decompress_size_limit():
+    """ Test that payloads decompressing past the limit are refused. """
+    compressed = crypto.compress_payload(b'\0' * 10000, crypto.DEFLATE)
+    assert crypto.decompress_payload(compressed, crypto.DEFLATE) == b'\0' * 10000
+    with pytest.raises(ValueError):
+        crypto.decompress_payload(compressed, crypto.DEFLATE, max_size=1000)
+    with pytest.raises(ValueError):
+        crypto.decompress_payload(compressed, 'unknown')
+
+@pytest.mark.skipif(crypto.zstandard is None, reason='zstandard not installed')
+def test_zstd_decompress_without_content_size():
+    """ Test that zstd frames without a declared size are bounded and checked. """
+    def stream_compress(data):
+        output = io.BytesIO()
+        with crypto.zstandard.ZstdCompressor().stream_writer(output, closefd=False) as writer:
+            writer.write(data)
+        return output.getvalue()
+
+    small = stream_compress(b'\0' * 10000)
+    assert crypto.zstandard.frame_content_size(small) == -1
+    tracemalloc.start()
+    try:
+        assert crypto.decompress_payload(small, crypto.ZSTD) == b'\0' * 10000
+        assert tracemalloc.get_traced_memory()[1] < 1024 * 1024
+    finally:
+        tracemalloc.stop()
+    with pytest.raises(ValueError):
+        crypto.decompress_payload(small[:-3], crypto.ZSTD)
+
+    large = stream_compress(b'\0' * (4 * 1024 * 1024))
+    with pytest.raises(ValueError):
+        crypto.decompress_payload(large, crypto.ZSTD, max_size=1024 * 1024)
+
+def test_unpack_message_stream_many_recipients(keys):
+    """ Test that a protected header longer than a chunk is read incrementally. """
+    alice_vk, alice_sk = keys[0]
+    recipients = [crypto.create_keypair() for _ in range(200)]
+    packed = crypto.pack_message(
+        '{"hello": "world"}', [vk for vk, _ in recipients], alice_vk, alice_sk
+    )
+    assert len(packed) > crypto.EnvelopeReader.MAX_PENDING
+
+    chunks = [packed[i:i + 4096] for i in range(0, len(packed), 4096)]
+    msg, _, _ = crypto.unpack_message_stream(chunks, *recipients[-1])
+    assert msg == b'{"hello": "world"}'
+
+    reader = crypto.EnvelopeReader(max_field_size=1024)
+    with pytest.raises(ValueError):
+        reader.feed(packed)
+
+def test_unpack_message_stream_short_key(keys):
+    """ Test that a truncated content encryption key is refused before decryption. """
+    _, (bob_vk, bob_sk) = keys
+    protected = json.dumps({
+        'enc': 'xchacha20poly1305_ietf',
+        'typ': 'JWM/1.0',
+        'alg': 'Anoncrypt',
+        'recipients': [{
+            'encrypted_key': crypto.bytes_to_b64(
+                crypto.anon_crypt_message(b'x', bob_vk), urlsafe=True
+            ),
+            'header': {'kid': crypto.bytes_to_b58(bob_vk), 'sender': None, 'iv': None},
+        }],
+    })
+    packed = json.dumps({
+        'protected': crypto.bytes_to_b64(protected.encode('ascii'), urlsafe=True),
+        'iv': crypto.bytes_to_b64(b'\0' * 12, urlsafe=True),
+        'ciphertext': crypto.bytes_to_b64(b'\0' * 32, urlsafe=True),
+        'tag': crypto.bytes_to_b64(b'\0' * 16, urlsafe=True),
+    }).encode('ascii')
+
+    with pytest.raises(ValueError):
+        crypto.unpack_message(packed, bob_vk, bob_sk)
+    with pytest.raises(ValueError, match='key'):
+        crypto.unpack_message_stream([packed], bob_vk, bob_sk)
@@ -0,0 +1,78 @@
+""" Test replay caches """
+import pytest
+
+from aries_staticagent import ReplayCache, SQLiteReplayCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_cache(request, tmp_path, clock):
+    """ Build either cache backend with a controllable clock. """
+    caches = []
+
+    def _make(**kwargs):
+        if request.param == 'memory':
+            cache = ReplayCache(clock=clock, **kwargs)
+        else:
+            cache = SQLiteReplayCache(str(tmp_path / 'seen.db'), clock=clock, **kwargs)
+        caches.append(cache)
+        return cache
+
+    yield _make
+    for cache in caches:
+        if isinstance(cache, SQLiteReplayCache):
+            cache.close()
+
+def test_duplicates_detected(make_cache):
+    """ Test that a repeated (sender, @id) is reported as seen. """
+    cache = make_cache()
+    assert not cache.seen('sender', '1')
+    assert cache.seen('sender', '1')
+    assert not cache.seen('other', '1')
+    assert not cache.seen('sender', '2')
+
+def test_forget(make_cache):
+    """ Test that a forgotten message is no longer reported as seen. """
+    cache = make_cache()
+    assert not cache.seen('sender', '1')
+    cache.forget('sender', '1')
+    assert len(cache) == 0
+    assert not cache.seen('sender', '1')
+
+def test_entries_expire(make_cache, clock):
+    """ Test that entries are forgotten after the TTL. """
+    cache = make_cache(ttl=10)
+    cache.seen('sender', '1')
+    clock.now = 9
+    assert cache.seen('sender', '1')
+    clock.now = 10
+    assert not cache.seen('sender', '1')
+
+def test_size_bounded(make_cache, clock):
+    """ Test that the oldest entries are evicted beyond maxsize. """
+    cache = make_cache(maxsize=2)
+    for msg_id in ('1', '2', '3'):
+        clock.now += 1
+        cache.seen('sender', msg_id)
+    assert len(cache) == 2
+    assert not cache.seen('sender', '1')
+
+def test_sqlite_survives_restart(tmp_path):
+    """ Test that the SQLite cache remembers messages across instances. """
+    path = str(tmp_path / 'seen.db')
+    cache = SQLiteReplayCache(path)
+    cache.seen('sender', '1')
+    cache.close()
+
+    cache = SQLiteReplayCache(path)
+    assert cache.seen('sender', '1')
+    cache.close()
@@ -0,0 +1,101 @@
+""" Test instrumentation """
+import json
+
+import pytest
+
+from aries_staticagent import StaticAgentConnection, crypto
+from aries_staticagent.agent import Agent, NoRegisteredRouteException
+from aries_staticagent.messages import Message
+from aries_staticagent.module import module
+from aries_staticagent.instrumentation import InMemoryInstrumentation, prometheus_text
+
+@pytest.mark.asyncio
+async def test_connection_instrumented():
+    """ Test that handling messages reports timings and counts. """
+    my_vk, my_sk = crypto.create_keypair()
+    their_vk, their_sk = crypto.create_keypair()
+    instrumentation = InMemoryInstrumentation()
+    conn = StaticAgentConnection(
+        'http://127.0.0.1:1/',
+        crypto.bytes_to_b58(their_vk),
+        crypto.bytes_to_b58(my_vk),
+        crypto.bytes_to_b58(my_sk),
+        instrumentation=instrumentation
+    )
+
+    @conn.route('test_protocol/1.0/testing_type')
+    async def testing_type(agent, msg):
+        pass
+
+    def packed(msg_type):
+        return crypto.pack_message(json.dumps({'@type': msg_type}), [my_vk], their_vk, their_sk)
+
+    await conn.handle(packed('test_protocol/1.0/testing_type'))
+    await conn.handle(packed('test_protocol/1.0/testing_type'))
+    with pytest.raises(NoRegisteredRouteException):
+        await conn.handle(packed('test_protocol/1.0/unknown'))
+
+    snapshot = instrumentation.snapshot()
+    assert snapshot['timers']['unpack']['count'] == 3
+    assert snapshot['timers']['deserialize']['count'] == 3
+    assert snapshot['timers']['route_resolution']['count'] == 3
+    assert snapshot['timers']['handler']['count'] == 2
+    assert snapshot['counters']['messages'] == {
+        'test_protocol/1.0/testing_type': 2,
+        'other': 1,
+    }
+    assert snapshot['counters']['no_route'] == {'other': 1}
+
+    text = prometheus_text(instrumentation)
+    assert 'aries_staticagent_unpack_seconds_bucket{le="+Inf"} 3' in text
+    assert 'aries_staticagent_unpack_seconds_count 3' in text
+    assert 'aries_staticagent_no_route_total{type="other"} 1' in text
+
+@pytest.mark.asyncio
+async def test_unrouted_types_share_label():
+    """ Test that sender-chosen unrouted types do not add counter labels. """
+    my_vk, my_sk = crypto.create_keypair()
+    their_vk, their_sk = crypto.create_keypair()
+    instrumentation = InMemoryInstrumentation()
+    conn = StaticAgentConnection(
+        'http://127.0.0.1:1/',
+        crypto.bytes_to_b58(their_vk),
+        crypto.bytes_to_b58(my_vk),
+        crypto.bytes_to_b58(my_sk),
+        instrumentation=instrumentation
+    )
+
+    for i in range(10):
+        packed = crypto.pack_message(
+            json.dumps({'@type': 'test_protocol/1.0/unknown_{}'.format(i)}),
+            [my_vk], their_vk, their_sk
+        )
+        with pytest.raises(NoRegisteredRouteException):
+            await conn.handle(packed)
+
+    counters = instrumentation.snapshot()['counters']
+    assert counters['messages'] == {'other': 10}
+    assert counters['no_route'] == {'other': 10}
+
+@pytest.mark.asyncio
+async def test_module_minor_versions_share_label():
+    """ Test that minor versions routed to one module share a label. """
+    instrumentation = InMemoryInstrumentation()
+    agent = Agent(instrumentation=instrumentation)
+
+    @module
+    class TestModule:
+        DOC_URI = ''
+        PROTOCOL = 'test_protocol'
+        VERSION = '1.0'
+
+        async def testing_type(self, agent, msg, *args, **kwargs):
+            pass
+
+    agent.route_module(TestModule())
+    for minor in range(20):
+        await agent.handle(Message({'@type': 'test_protocol/1.{}/testing_type'.format(minor)}))
+
+    assert instrumentation.snapshot()['counters']['messages'] == {
+        'test_protocol/1.0.0/testing_type': 20
+    }
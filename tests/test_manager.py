@@ -0,0 +1,72 @@
+""" Test StaticAgentConnectionManager """
+import json
+
+from aiohttp import web
+import pytest
+
+from aries_staticagent import StaticAgentConnectionManager, crypto
+from aries_staticagent.manager import UnknownConnectionException
+
+def b58(key):
+    return crypto.bytes_to_b58(key)
+
+@pytest.mark.asyncio
+async def test_manager_dispatch():
+    """ Test that inbound messages reach the connection they're packed for. """
+    their_vk, their_sk = crypto.create_keypair()
+    manager = StaticAgentConnectionManager(precompute_shared_keys=True)
+
+    handled = {}
+    keys = []
+    for index in range(5):
+        my_vk, my_sk = crypto.create_keypair()
+        keys.append(my_vk)
+        conn = manager.connect('http://127.0.0.1:1/', b58(their_vk), b58(my_vk), b58(my_sk))
+
+        @conn.route('test_protocol/1.0/testing_type')
+        async def testing_type(agent, msg, index=index):
+            handled[index] = msg['n']
+
+    for index, my_vk in enumerate(keys):
+        await manager.handle(crypto.pack_message(
+            json.dumps({'@type': 'test_protocol/1.0/testing_type', 'n': index}),
+            [my_vk], their_vk, their_sk
+        ))
+
+    assert handled == {index: index for index in range(5)}
+
+    other_vk, other_sk = crypto.create_keypair()
+    with pytest.raises(UnknownConnectionException):
+        await manager.handle(crypto.pack_message(
+            json.dumps({'@type': 'test_protocol/1.0/testing_type', 'n': 0}),
+            [keys[0]], other_vk, other_sk
+        ))
+
+    session = manager.get(keys[0]).session
+    assert manager.get(b58(keys[1])).session is session
+    await manager.close()
+    assert session.closed
+
+@pytest.mark.asyncio
+async def test_manager_close_delivers_queued(serve):
+    """ Test that closing the manager closes connections before the session. """
+    received = []
+
+    async def handle(request):
+        received.append(await request.read())
+        raise web.HTTPAccepted()
+
+    url = await serve(handle)
+
+    their_vk, _ = crypto.create_keypair()
+    my_vk, my_sk = crypto.create_keypair()
+    manager = StaticAgentConnectionManager()
+    conn = manager.connect(url, b58(their_vk), b58(my_vk), b58(my_sk))
+    conn.queue_outbound = True
+    await conn.send({'@type': 'test_protocol/1.0/testing_type'})
+    session = manager.session
+    await manager.close()
+
+    assert len(received) == 1
+    assert not conn.outbound.running
+    assert session.closed
@@ -0,0 +1,114 @@
+""" Test Message """
+import pytest
+
+from aries_staticagent import messages
+from aries_staticagent.messages import InvalidMessageType, Message, Noop
+
+def test_parse_type_info():
+    """ Test that type information is parsed from @type. """
+    msg = Message({'@type': 'did:sov:abc;spec/test_protocol/1.2/testing_type'})
+    assert msg.doc_uri == 'did:sov:abc;spec/'
+    assert msg.protocol == 'test_protocol'
+    assert msg.version == '1.2'
+    assert msg.short_type == 'testing_type'
+    assert msg.qualified_protocol == 'did:sov:abc;spec/test_protocol'
+    assert (msg.version_info.major, msg.version_info.minor) == (1, 2)
+
+def test_invalid_type():
+    """ Test that invalid types are rejected when type info is accessed. """
+    msg = Message({'@type': 'not a type'})
+    with pytest.raises(InvalidMessageType):
+        msg.protocol
+    msg = Message({'@type': 'test_protocol/1.x/testing_type'})
+    with pytest.raises(InvalidMessageType):
+        msg.version_info
+
+def test_type_change_reparsed():
+    """ Test that changing @type invalidates parsed type info. """
+    msg = Message({'@type': 'test_protocol/1.0/testing_type'})
+    assert msg.short_type == 'testing_type'
+    msg['@type'] = 'test_protocol/1.0/other_type'
+    assert msg.short_type == 'other_type'
+
+def test_id_generated_on_serialize():
+    """ Test that @id is only added when needed. """
+    msg = Message({'@type': 'test_protocol/1.0/testing_type'})
+    assert '@id' not in msg
+    serialized = msg.serialize()
+    assert msg.id in serialized
+    assert Message.deserialize(serialized) == msg
+    assert not hasattr(msg, '__dict__')
+
+def test_serialize_bytes():
+    """ Test that messages serialize to UTF-8 bytes and can keep them. """
+    msg = Message({'@type': 'test_protocol/1.0/testing_type', 'content': 'Grüße'})
+    serialized = msg.serialize(as_bytes=True)
+    assert isinstance(serialized, bytes)
+    assert 'Grüße'.encode('utf-8') in serialized
+
+    received = Message.deserialize(serialized, keep_raw=True)
+    assert received == msg
+    assert received.raw is serialized
+    assert Message.deserialize(serialized).raw is None
+
+def test_serialize_bytes_orjson_fallback():
+    """ Test that data orjson rejects still serializes like json.dumps. """
+    pytest.importorskip('orjson')
+    msg = Message({
+        '@type': 'test_protocol/1.0/testing_type',
+        'keys': {1: 'a'},
+        'big': 2 ** 70,
+    })
+    assert Message.deserialize(msg.serialize(as_bytes=True)).data == \
+        Message.deserialize(msg.serialize()).data
+
+def test_dict_operators():
+    """ Test the merge operators and fromkeys that UserDict provides. """
+    msg = Message({'@type': 'test_protocol/1.0/testing_type', 'a': 1})
+    assert msg.short_type == 'testing_type'
+
+    merged = msg | {'@type': 'test_protocol/1.0/other_type'}
+    assert isinstance(merged, Message)
+    assert merged.short_type == 'other_type'
+    assert msg.short_type == 'testing_type'
+
+    merged = {'b': 2} | msg
+    assert isinstance(merged, Message)
+    assert merged.data == {'b': 2, '@type': 'test_protocol/1.0/testing_type', 'a': 1}
+    assert isinstance(Noop() | {'a': 1}, Noop)
+
+    msg |= {'@type': 'test_protocol/1.0/other_type'}
+    assert msg.short_type == 'other_type'
+
+    assert Message.fromkeys(['a', 'b'], 0).data == {'a': 0, 'b': 0}
+
+def test_type_cache():
+    """ Test that parsed types are cached with hit and miss counts. """
+    messages.set_type_cache_size(2)
+    try:
+        for _ in range(3):
+            Message({'@type': 'test_protocol/1.0/testing_type'}).version_info
+        Message({'@type': 'test_protocol/1.0/other_type'}).version_info
+        Message({'@type': 'test_protocol/2.0/testing_type'}).version_info
+
+        info = messages.type_cache_info()
+        assert (info.hits, info.misses) == (2, 3)
+        assert (info.maxsize, info.currsize) == (2, 2)
+    finally:
+        messages.set_type_cache_size(messages.TYPE_CACHE_SIZE)
+
+def test_package_exports():
+    """ Test that the package keeps exporting its original names. """
+    import aries_staticagent
+    assert aries_staticagent.Message is Message
+    assert aries_staticagent.Agent.__name__ == 'Agent'
+    assert aries_staticagent.crypto.pack_message
+
+def test_copy_subclass():
+    """ Test that copies keep their class and don't share data. """
+    msg = Noop(return_route=True)
+    copied = msg.copy()
+    assert type(copied) is Noop
+    assert copied == msg
+    copied['extra'] = 1
+    assert 'extra' not in msg
@@ -0,0 +1,28 @@
+""" Test Outbox """
+from aries_staticagent import Outbox
+
+def test_pending_in_order_per_endpoint(tmp_path):
+    """ Test that entries are returned oldest first for their endpoint only. """
+    outbox = Outbox(str(tmp_path / 'outbox.db'), batch_size=2)
+    outbox.put('http://a/', [b'1', b'2', b'3'])
+    outbox.put('http://b/', [b'4'])
+
+    batch = outbox.pending('http://a/')
+    assert [msg for _, msg in batch] == [b'1', b'2']
+
+    outbox.remove([entry_id for entry_id, _ in batch])
+    assert [msg for _, msg in outbox.pending('http://a/')] == [b'3']
+    assert len(outbox) == 2
+    outbox.close()
+
+def test_survives_restart(tmp_path):
+    """ Test that undelivered entries are kept across instances. """
+    path = str(tmp_path / 'outbox.db')
+    outbox = Outbox(path)
+    outbox.put('http://a/', [b'1'])
+    outbox.close()
+
+    outbox = Outbox(path)
+    assert [msg for _, msg in outbox.pending('http://a/')] == [b'1']
+    outbox.compact()
+    outbox.close()
@@ -0,0 +1,80 @@
+""" Test SyncStaticAgentConnection """
+import gc
+import threading
+import weakref
+
+from aiohttp import web
+
+from aries_staticagent import StaticAgentConnection, SyncStaticAgentConnection, crypto
+from aries_staticagent import connection
+from aries_staticagent.sync import BackgroundLoop
+
+def test_sync_send_many():
+    """ Test sending from synchronous code through the background loop. """
+    background = BackgroundLoop()
+    received = []
+
+    async def handle(request):
+        received.append(await request.read())
+        raise web.HTTPAccepted()
+
+    async def start_server():
+        app = web.Application()
+        app.add_routes([web.post('/', handle)])
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        return runner, site._server.sockets[0].getsockname()[1]
+
+    runner, port = background.submit(start_server()).result()
+
+    my_vk, my_sk = crypto.create_keypair()
+    their_vk, _ = crypto.create_keypair()
+    try:
+        with SyncStaticAgentConnection(
+                'http://127.0.0.1:{}/'.format(port),
+                crypto.bytes_to_b58(their_vk),
+                crypto.bytes_to_b58(my_vk),
+                crypto.bytes_to_b58(my_sk)) as conn:
+            threads = [
+                threading.Thread(target=lambda: conn.send(
+                    {'@type': 'test_protocol/1.0/testing_type'}
+                ).result())
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            conn.send_many(
+                [{'@type': 'test_protocol/1.0/testing_type'}] * 4
+            ).result()
+            session = conn.connection.session
+        assert session.closed
+    finally:
+        background.submit(runner.cleanup()).result()
+        background.stop()
+
+    assert len(received) == 8
+
+def test_close_blocking_releases_connection():
+    """ Test that closed blocking loops leave nothing registered for exit. """
+    my_vk, my_sk = crypto.create_keypair()
+    their_vk, _ = crypto.create_keypair()
+    conn = StaticAgentConnection(
+        'http://127.0.0.1:1/',
+        crypto.bytes_to_b58(their_vk),
+        crypto.bytes_to_b58(my_vk),
+        crypto.bytes_to_b58(my_sk)
+    )
+    for _ in range(3):
+        conn._blocking()
+        assert conn in connection._blocking_connections
+        conn.close_blocking()
+    assert conn not in connection._blocking_connections
+
+    ref = weakref.ref(conn)
+    del conn
+    gc.collect()
+    assert ref() is None